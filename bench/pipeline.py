@@ -0,0 +1,137 @@
+"""
+Офлайн-бенчмарк всего core.main на синтетических слайдах (bench/synth.py)
+с воркерами-заглушками из bench/standins (без весов YOLO и GPU).
+
+Из корня репозитория:
+    python bench/pipeline.py --count 48 --latency whiteboard=60,class_cutter=25,ocr=10
+    python bench/pipeline.py --workers ocr=4 --window 2 --busy
+    python bench/pipeline.py --ocr tesseract          # настоящий Tesseract, если установлен
+    python bench/pipeline.py --no-streaming --transport file
+    python bench/pipeline.py --fused --count 12          # один процесс, один запрос на фотографию
+    python bench/pipeline.py --host-models whiteboard,class_cutter    # модели двух стадий в одном процессе
+    python bench/pipeline.py --repeats 3 --dedup-distance 5    # по 3 снимка слайда, поиск повторов с порогом 5 бит
+
+Печатает изображений/с, задержки по стадиям и пиковый RSS;
+полный отчёт - <out>/run_summary.json.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import synth
+
+
+ROOT = Path(__file__).resolve().parent.parent
+STANDINS = Path(__file__).resolve().parent / "standins"
+STAGES = ("whiteboard", "class_cutter", "ocr")
+SCRIPTS = STAGES + ("fused",)
+
+
+def parse_kv(s, cast=int):
+    out = {}
+    for part in (s or "").split(","):
+        key, _, value = part.partition("=")
+        if key.strip():
+            if key.strip() not in STAGES:
+                raise ValueError(f"unknown stage: {key}")
+            out[key.strip()] = cast(value)
+    return out
+
+
+def configure_core(core, args, images_dir, out_dir):
+    workers = parse_kv(args.workers)
+    batch = parse_kv(args.batch)
+
+    core.DIR_WITH_IMAGES_FOR_ANALYZE = str(images_dir)
+    core.RESULT_SAVE_DIR = str(out_dir)
+    core.MODE = 0
+    core.PIPELINE_STREAMING = not args.no_streaming
+    core.IMAGE_TRANSPORT = args.transport
+    core.WORKER_WINDOW = args.window
+    core.WHITEBOARD_WORKERS = workers.get("whiteboard", 1)
+    core.CLASS_CUTTER_WORKERS = workers.get("class_cutter", 1)
+    core.OCR_WORKERS = workers.get("ocr", 1)
+    core.WHITEBOARD_BATCH_SIZE = batch.get("whiteboard", 1)
+    core.CLASS_CUTTER_BATCH_SIZE = batch.get("class_cutter", 1)
+    # результаты заглушек не должны попасть в постоянный кэш настоящих стадий
+    core.STAGE_CACHE_DIR = ''
+    core.WORKER_DAEMON_DIR = ''
+    core.SUMMARY_FILENAME = 'run_summary.json'
+    core.TRACE_FILENAME = args.trace
+    core.FUSED_PIPELINE = args.fused
+    if args.dedup_distance is not None:
+        core.SLIDE_DEDUP = args.dedup_distance >= 0
+        core.SLIDE_DEDUP_MAX_DISTANCE = args.dedup_distance
+    core.MODEL_HOST_MODELS = tuple(n.strip() for n in args.host_models.split(",") if n.strip())
+    core.WORKER_SCRIPTS = {name: str(STANDINS / f"{name}_standin.py") for name in SCRIPTS}
+    # заглушки стадий загружает настоящий model_host_worker.py
+    core.WORKER_SCRIPTS["model_host"] = str(ROOT / "src" / "model_host_worker.py")
+
+
+def report(summary):
+    print()
+    print(f"inputs={summary['inputs']}  wall={summary['wall_s']} s  images/s={summary['images_per_s']}")
+    print(f"{'stage':<13} {'img/s':>8} {'errors':>6} {'total p50':>10} {'p95':>8} "
+          f"{'compute p50':>12} {'queue p50':>10} {'ipc p50':>8} {'RSS MB':>7}")
+    for name, st in summary["stages"].items():
+        lat = st["latency_ms"]
+        print(f"{name:<13} {str(st['images_per_s']):>8} {st['errors']:>6} "
+              f"{str(lat['total']['p50']):>10} {str(lat['total']['p95']):>8} "
+              f"{str(lat['compute']['p50']):>12} {str(lat['queue']['p50']):>10} "
+              f"{str(lat['ipc']['p50']):>8} {str(st['peak_rss_mb']):>7}")
+    dedup = summary.get("dedup")
+    if dedup:
+        print(f"dedup: kept {dedup.get('kept', 0)}, skipped {dedup.get('skipped', 0)} repeat shots")
+    rss = summary["peak_rss_mb"]
+    print(f"peak RSS: {rss['total']} MB total, orchestrator {rss['orchestrator']} MB, "
+          f"workers {rss['workers']} MB ({rss['processes']} processes)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--count", type=int, default=24, help="число синтетических слайдов")
+    ap.add_argument("--size", default="1600x1200", help="размер «фотографии», WxH")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeats", type=int, default=1, help="снимков каждого слайда (пересъёмка)")
+    ap.add_argument("--dedup-distance", type=int, default=None,
+                    help="включить SLIDE_DEDUP с этим порогом, бит из 256;  -1 - выключить")
+    ap.add_argument("--latency", default="whiteboard=60,class_cutter=25,ocr=10",
+                    help="имитация времени моделей, мс на изображение")
+    ap.add_argument("--busy", action="store_true", help="имитировать задержку занятым CPU, а не sleep")
+    ap.add_argument("--ocr", choices=("fake", "tesseract"), default="fake")
+    ap.add_argument("--workers", default="", help="процессов на стадию, например ocr=4")
+    ap.add_argument("--batch", default="", help="размер do_batch, например whiteboard=4")
+    ap.add_argument("--window", type=int, default=1)
+    ap.add_argument("--transport", choices=("shm", "file"), default="shm")
+    ap.add_argument("--no-streaming", action="store_true")
+    ap.add_argument("--fused", action="store_true", help="все стадии в одном процессе (FUSED_PIPELINE)")
+    ap.add_argument("--host-models", default="", help="стадии в одном процессе (MODEL_HOST_MODELS), например whiteboard,class_cutter")
+    ap.add_argument("--trace", default="", help="имя файла трассы в --out (например trace.json)")
+    ap.add_argument("--out", default=str(ROOT / "bench" / "out"))
+    args = ap.parse_args()
+
+    out_dir = Path(args.out).resolve()
+    images_dir = out_dir / "slides"
+    synth.generate(images_dir, args.count, seed=args.seed, size=synth.parse_size(args.size),
+                   repeats=args.repeats)
+
+    os.environ["BENCH_LATENCY_MS"] = args.latency
+    os.environ["BENCH_BUSY"] = "1" if args.busy else "0"
+    os.environ["BENCH_OCR"] = args.ocr
+
+    sys.path.insert(0, str(ROOT / "src"))
+    import core
+
+    configure_core(core, args, images_dir, out_dir)
+    # кэш стадий (cache/) - внутри out, а не в текущей директории
+    os.chdir(out_dir)
+    core.main()
+
+    summary = json.loads((out_dir / core.SUMMARY_FILENAME).read_text(encoding="utf-8"))
+    report(summary)
+
+
+if __name__ == "__main__":
+    main()
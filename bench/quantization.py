@@ -0,0 +1,198 @@
+"""
+Квантованные модели против fp32 (onnxruntime): ускорение и совпадение результатов по изображениям.
+
+Совпадение:
+  whiteboard   - IoU маски выбранного четырёхугольника экрана/доски (как в WhiteboadWorker._process_image)
+  class_cutter - доля совпавших рамок: тот же класс и IoU рамок не ниже --box-iou
+
+Из корня репозитория (held-out изображения - не те, на которых калибровали):
+    python bench/quantization.py --model whiteboard --images data/heldout --precisions fp16,int8
+    python bench/quantization.py --model class_cutter --images data/heldout \\
+        --calib-images data/calib --calib-count 64     # собрать best.int8.onnx со статической калибровкой
+
+Квантизация включается в core.py (MODEL_PRECISION) только для моделей,
+где потеря качества измерена и приемлема.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import yolo_backend  # noqa: E402
+from whiteboard_worker import WhiteboadWorker  # noqa: E402
+
+
+IMG_EXTS = {".jpg", ".jpeg", ".png"}
+CONF = {"whiteboard": 0.25, "class_cutter": 0.3}
+
+
+def load_images(images_dir, count=None):
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMG_EXTS)
+    out = []
+    for p in paths[:count]:
+        img = cv2.imread(str(p), cv2.IMREAD_COLOR)
+        if img is not None:
+            out.append((p.name, img))
+    if not out:
+        raise FileNotFoundError(f"no images in {images_dir}")
+    return out
+
+
+def timed_predict(model, img, conf, repeats):
+    best = None
+    pred = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        pred = model.predict([img], conf=conf, iou=0.5)[0]
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return pred, best * 1000
+
+
+def quad_mask(worker, pred, img, target_class, target_strategy):
+    """Маска выбранного четырёхугольника; None - модель ничего не нашла."""
+    H, W = img.shape[:2]
+    try:
+        idx = worker._select_detection_index(pred, target_class=target_class, target_strategy=target_strategy)
+    except RuntimeError:
+        return None
+    quad = worker._order_points_tl_tr_br_bl(worker._quad_for_index(pred, idx=idx, W=W, H=H))
+    out = np.zeros((H, W), dtype=np.uint8)
+    cv2.fillPoly(out, [quad.astype(np.int32)], 1)
+    return out
+
+
+def mask_iou(a, b):
+    if a is None or b is None:
+        return 1.0 if a is None and b is None else 0.0
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def box_match_rate(ref, var, min_iou):
+    """Жадное сопоставление рамок одного класса по убыванию IoU; доля от большего из двух наборов."""
+    ref_xyxy, ref_cls = ref.boxes.xyxy.cpu().numpy(), ref.boxes.cls.cpu().numpy().astype(int)
+    var_xyxy, var_cls = var.boxes.xyxy.cpu().numpy(), var.boxes.cls.cpu().numpy().astype(int)
+    total = max(len(ref_cls), len(var_cls))
+    if total == 0:
+        return 1.0
+
+    pairs = []
+    for i in range(len(ref_cls)):
+        for j in range(len(var_cls)):
+            if ref_cls[i] == var_cls[j]:
+                iou = box_iou(ref_xyxy[i], var_xyxy[j])
+                if iou >= min_iou:
+                    pairs.append((iou, i, j))
+    used_i, used_j = set(), set()
+    for _, i, j in sorted(pairs, reverse=True):
+        if i not in used_i and j not in used_j:
+            used_i.add(i)
+            used_j.add(j)
+    return len(used_i) / total
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", choices=sorted(CONF), default="whiteboard")
+    ap.add_argument("--images", required=True, help="held-out изображения")
+    ap.add_argument("--count", type=int, default=None)
+    ap.add_argument("--precisions", default="fp16,int8")
+    ap.add_argument("--calib-images", default=None, help="изображения для статической калибровки int8")
+    ap.add_argument("--calib-count", type=int, default=64)
+    ap.add_argument("--threads", type=int, default=0, help="intra-op потоков onnxruntime, 0 - по умолчанию")
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--target-class", type=int, default=0)
+    ap.add_argument("--target-strategy", choices=("conf", "size"), default="conf")
+    ap.add_argument("--box-iou", type=float, default=0.5)
+    ap.add_argument("--json", default=None, help="сохранить отчёт в файл")
+    args = ap.parse_args()
+
+    weights = ROOT / "weights" / args.model / "best.pt"
+    precisions = [p for p in args.precisions.split(",") if p.strip()]
+    conf = CONF[args.model]
+
+    fp32_path = yolo_backend.export_onnx(weights)
+    if args.calib_images and "int8" in precisions:
+        calib = yolo_backend.calibration_images(args.calib_images, args.calib_count)
+        int8_path = yolo_backend.variant_path(weights, "int8")
+        yolo_backend.quantize_int8(fp32_path, int8_path, calibration=calib)
+        yolo_backend.save_calibration_info(int8_path, args.calib_images, args.calib_count)
+        print(f"[ok] static int8 ({len(calib)} calibration images): {int8_path}")
+
+    models = {"fp32": yolo_backend.OnnxYOLO(fp32_path, intra_op=args.threads)}
+    for p in list(precisions):
+        path = yolo_backend.export_onnx(weights, precision=p)
+        if path == fp32_path:
+            # int8 без статической калибровки - мерить нечего
+            precisions.remove(p)
+            continue
+        models[p] = yolo_backend.OnnxYOLO(path, intra_op=args.threads, precision=p)
+
+    worker = WhiteboadWorker()
+    images = load_images(args.images, args.count)
+    for m in models.values():
+        m.predict([images[0][1]], conf=conf, iou=0.5)  # прогрев
+
+    rows = []
+    for name, img in images:
+        ref, ref_ms = timed_predict(models["fp32"], img, conf, args.repeats)
+        ref_mask = quad_mask(worker, ref, img, args.target_class, args.target_strategy) \
+            if args.model == "whiteboard" else None
+        row = {"image": name, "fp32_ms": round(ref_ms, 2)}
+        for p in precisions:
+            pred, ms = timed_predict(models[p], img, conf, args.repeats)
+            if args.model == "whiteboard":
+                agree = mask_iou(ref_mask, quad_mask(worker, pred, img, args.target_class, args.target_strategy))
+            else:
+                agree = box_match_rate(ref, pred, args.box_iou)
+            row[p] = {"ms": round(ms, 2), "speedup": round(ref_ms / ms, 3), "agreement": round(agree, 4)}
+        rows.append(row)
+
+    metric = "quad IoU" if args.model == "whiteboard" else f"box match@{args.box_iou}"
+    header = f"{'image':<28} {'fp32 ms':>8}" + "".join(f" | {p + ' ms':>9} {'speedup':>7} {metric:>13}" for p in precisions)
+    print(header)
+    for row in rows:
+        line = f"{row['image'][:28]:<28} {row['fp32_ms']:>8}"
+        for p in precisions:
+            r = row[p]
+            line += f" | {r['ms']:>9} {r['speedup']:>6}x {r['agreement']:>13}"
+        print(line)
+
+    summary = {}
+    for p in precisions:
+        agree = [row[p]["agreement"] for row in rows]
+        speed = [row[p]["speedup"] for row in rows]
+        summary[p] = {
+            "median_speedup": round(statistics.median(speed), 3),
+            "mean_agreement": round(statistics.mean(agree), 4),
+            "min_agreement": round(min(agree), 4),
+        }
+        print(f"{p}: median speedup {summary[p]['median_speedup']}x, "
+              f"{metric} mean {summary[p]['mean_agreement']}, min {summary[p]['min_agreement']}")
+
+    if args.json:
+        report = {"model": args.model, "metric": metric, "images": rows, "summary": summary}
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[ok] report: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+
+import standin
+from worker_base import BaseWorker
+
+
+class ClassCutterStandin(BaseWorker):
+    """Вместо YOLO - строки текста по горизонтальной проекции, все с классом 0 (печатный текст)."""
+
+    def on_start(self):
+        self.latency = standin.latency_s("class_cutter")
+        return {"name": "class-cutter-standin", "ready": True}
+
+
+    def _process_image(self, img, min_height=8, pad=6):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+        rows = (ink > 0).mean(axis=1) > 0.005
+
+        bands = []
+        start = None
+        for y, on in enumerate(np.append(rows, False)):
+            if on and start is None:
+                start = y
+            elif not on and start is not None:
+                if y - start >= min_height:
+                    bands.append((max(0, start - pad), min(img.shape[0], y + pad)))
+                start = None
+
+        w = img.shape[1]
+        return [{"id": i, "cls": 0, "box": [0, y1, w, y2]} for i, (y1, y2) in enumerate(bands, start=1)]
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        src_img = standin.read_input(payload)
+        standin.fake_compute(self.latency)
+        classes = payload.get("classes")
+        return {"boxes": [b for b in self._process_image(src_img) if classes is None or b["cls"] in classes]}
+
+
+    def on_shutdown(self):
+        return {"bye": True}
+
+if __name__ == "__main__":
+    ClassCutterStandin().run()
@@ -0,0 +1,100 @@
+import standin
+from class_cutter_standin import ClassCutterStandin
+from ocr_standin import OCRStandin
+from whiteboard_standin import WhiteboardStandin
+from worker_base import BaseWorker
+
+
+class FusedStandin(BaseWorker):
+    """Заглушки трёх стадий в одном процессе - протокол fused_worker.py."""
+
+    def __init__(self):
+        super().__init__()
+        self.whiteboard = WhiteboardStandin()
+        self.cutter = ClassCutterStandin()
+        self.ocr = OCRStandin()
+
+
+    def on_start(self):
+        for worker in (self.whiteboard, self.cutter, self.ocr):
+            worker.on_start()
+        return {"name": "fused-standin", "ready": True}
+
+
+    def warmup(self):
+        self.ocr.warmup()
+
+
+    def _warp(self, payload, errors):
+        img = None
+        try:
+            img = standin.read_input(payload)
+            standin.fake_compute(self.whiteboard.latency)
+            return self.whiteboard._process_image(img)
+        except Exception as e:
+            if not payload.get("whiteboard_fallback"):
+                raise
+            error = str(e)
+
+        # как fused_worker.py: дальше идёт вся фотография, недекодируемая - пустой блок
+        if img is None:
+            try:
+                img = standin.read_input(payload)
+            except Exception as e:
+                error = f"cannot decode frame: {e}"
+        errors.append({"stage": "whiteboard", "error": error})
+        return img
+
+
+    def _boxes(self, warp, payload, errors):
+        try:
+            standin.fake_compute(self.cutter.latency)
+            return self.cutter._process_image(warp)
+        except Exception as e:
+            errors.append({"stage": "class_cutter", "error": str(e)})
+            if payload.get("class_cutter_fallback"):
+                return [{"id": 0, "cls": 0, "box": None, "route": "ocr_printed"}]
+            return []
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        errors = []
+        warp = self._warp(payload, errors)
+        if warp is None:
+            return {"text": "", "crops": [], "figures": [], "errors": errors}
+
+        routes = payload["routes"]
+        crops = []
+        for box in self._boxes(warp, payload, errors):
+            route = box.get("route") or routes.get(str(box["cls"]), "drop")
+            if route not in ("ocr_printed", "ocr_handwritten"):
+                continue
+            try:
+                if box["box"] is None:
+                    crop = warp
+                else:
+                    x1, y1, x2, y2 = box["box"]
+                    crop = warp[y1:y2, x1:x2]
+                res = self.ocr.recognize(crop, {"route": route})
+            except Exception as e:
+                errors.append({"stage": "ocr", "crop": f"{box['id']}_{box['cls']}", "error": str(e)})
+                continue
+            crops.append({"id": box["id"], "cls": box["cls"], "route": route, **res})
+
+        return {
+            "text": "\n\n".join(c["tesseract_text"] for c in crops if c["tesseract_text"]),
+            "crops": crops,
+            "figures": [],
+            "errors": errors,
+        }
+
+
+    def on_shutdown(self):
+        self.ocr.on_shutdown()
+        return {"bye": True}
+
+if __name__ == "__main__":
+    FusedStandin().run()
@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import standin
+from worker_base import BaseWorker
+
+
+class OCRStandin(BaseWorker):
+    """
+    BENCH_OCR=tesseract - настоящая tesseract-часть baseOCR2_worker (если pytesseract и tesseract установлены);
+    иначе - заданная задержка и текст-заглушка с размером кропа.
+    """
+
+    def on_start(self):
+        self.latency = standin.latency_s("ocr")
+        self.real = None
+        if os.environ.get("BENCH_OCR") == "tesseract":
+            if shutil.which("tesseract") is None:
+                raise RuntimeError("BENCH_OCR=tesseract, but tesseract is not installed")
+            from baseOCR2_worker import BaceOCRWorker
+            self.real = BaceOCRWorker()
+            self.real.init_tesseract()
+        return {"name": "ocr-standin", "ready": True, "tesseract": self.real is not None}
+
+
+    def warmup(self):
+        if self.real is not None:
+            import numpy as np
+            self.real.ocr_tesseract(np.full((64, 256, 3), 255, dtype=np.uint8), cls_id="0")
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        return self.recognize(standin.read_crop(payload), payload)
+
+
+    def recognize(self, img, payload):
+        if self.real is not None:
+            text = self.real.ocr_tesseract(img, cls_id=self.real._cls_id(payload)).strip()
+        else:
+            standin.fake_compute(self.latency)
+            h, w = img.shape[:2]
+            text = f"<{w}x{h}>"
+
+        return {"tesseract_text": text, "easyocr_text": ""}
+
+
+    def on_shutdown(self):
+        if self.real is not None:
+            self.real.on_shutdown()
+        return {"bye": True}
+
+if __name__ == "__main__":
+    OCRStandin().run()
@@ -0,0 +1,80 @@
+"""
+Общие части воркеров-заглушек (bench/pipeline.py).
+
+Заглушки говорят тем же JSONL-протоколом, что и настоящие воркеры из src/,
+но вместо моделей делают дешёвую обработку OpenCV и ждут заданное время:
+BENCH_LATENCY_MS="whiteboard=60,class_cutter=25,ocr=10";
+BENCH_BUSY=1 - ждать, занимая CPU (как инференс), а не через sleep.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+SRC = Path(__file__).resolve().parents[2] / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from shm_frames import get_frame, put_frame  # noqa: E402
+
+
+def latency_s(stage):
+    for part in os.environ.get("BENCH_LATENCY_MS", "").split(","):
+        key, _, value = part.partition("=")
+        if key.strip() == stage and value.strip():
+            return float(value) / 1000
+    return 0.0
+
+
+def fake_compute(seconds):
+    if seconds <= 0:
+        return
+    if os.environ.get("BENCH_BUSY") == "1":
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+    else:
+        time.sleep(seconds)
+
+
+def read_input(payload):
+    """Кадр из shared memory или файла - как _read настоящих воркеров."""
+    if payload.get("image"):
+        return get_frame(payload["image"])
+    image_path = str(payload["image_path"])
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise FileNotFoundError(f"cannot read image: {image_path}")
+    return img
+
+
+_last_slide = (None, None)
+
+
+def read_crop(payload):
+    """Кроп OCR: слайд (декодируется один раз на все его кропы) и рамка от class cutter (None - весь слайд)."""
+    global _last_slide
+    key = (payload.get("image") or {}).get("shm") or payload["image_path"]
+    if _last_slide[0] != key:
+        _last_slide = (key, read_input(payload))
+    img = _last_slide[1]
+    box = payload.get("box")
+    if box is None:
+        return img
+    x1, y1, x2, y2 = box
+    return img[y1:y2, x1:x2]
+
+
+def emit(img, out_path, payload):
+    """Файл и/или кадр в shared memory в зависимости от transport/save."""
+    shm = payload.get("transport") == "shm"
+    out = {}
+    if not shm or payload.get("save"):
+        if not cv2.imwrite(str(out_path), img):
+            raise RuntimeError(f"failed to write image: {out_path}")
+        out["path"] = str(out_path)
+    if shm:
+        out["image"] = put_frame(img)
+    return out
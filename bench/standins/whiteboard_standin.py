@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+import standin
+from whiteboard_worker import slide_hash
+from worker_base import BaseWorker
+
+
+class WhiteboardStandin(BaseWorker):
+    """Вместо YOLO-маски - самая большая светлая область, приведённая к прямоугольнику."""
+
+    def on_start(self):
+        self.latency = standin.latency_s("whiteboard")
+        return {"name": "whiteboard-standin", "ready": True}
+
+
+    def _order(self, pts):
+        s = pts.sum(axis=1)
+        d = np.diff(pts, axis=1).ravel()
+        return np.float32([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]])
+
+
+    def _process_image(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        if not contours:
+            raise RuntimeError("no slide found")
+
+        cnt = max(contours, key=cv2.contourArea)
+        quad = cv2.approxPolyDP(cnt, 0.02 * cv2.arcLength(cnt, True), True).reshape(-1, 2)
+        if len(quad) != 4:
+            quad = cv2.boxPoints(cv2.minAreaRect(cnt))
+        quad = self._order(quad.astype(np.float32))
+
+        w = int(max(np.linalg.norm(quad[1] - quad[0]), np.linalg.norm(quad[2] - quad[3])))
+        h = int(max(np.linalg.norm(quad[3] - quad[0]), np.linalg.norm(quad[2] - quad[1])))
+        dst = np.float32([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]])
+        m = cv2.getPerspectiveTransform(quad, dst)
+        return cv2.warpPerspective(img, m, (w, h))
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        img = standin.read_input(payload)
+        standin.fake_compute(self.latency)
+        warp = self._process_image(img)
+
+        out = standin.emit(warp, payload["out_path"], payload)
+        res = {"slide_hash": slide_hash(warp)}
+        if "path" in out:
+            res["warp_path"] = out["path"]
+        if "image" in out:
+            res["warp"] = out["image"]
+        return res
+
+
+    def on_shutdown(self):
+        return {"bye": True}
+
+if __name__ == "__main__":
+    WhiteboardStandin().run()
@@ -0,0 +1,105 @@
+"""
+Синтетические «сфотографированные» слайды для офлайн-бенчмарков.
+
+Слайд (белый фон, заголовок и строки текста cv2.putText) проецируется
+на тёмный фон со случайной перспективой, сверху - шум и лёгкое размытие.
+
+Из корня репозитория:
+    python bench/synth.py --out bench/out/slides --count 24
+"""
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+WORDS = (
+    "lecture gradient descent matrix vector kernel entropy loss function model layer "
+    "network batch epoch theorem proof lemma integral derivative limit series graph "
+    "node edge tree sort queue stack memory cache thread process signal filter"
+).split()
+
+
+def make_slide(rng, width=1280, height=720, lines=None):
+    slide = np.full((height, width, 3), 248, dtype=np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    title = " ".join(rng.choice(WORDS, size=3)).title()
+    cv2.putText(slide, title, (60, 90), font, 2.0, (40, 40, 40), 4, cv2.LINE_AA)
+
+    lines = lines or int(rng.integers(5, 10))
+    y = 170
+    for _ in range(lines):
+        if y > height - 40:
+            break
+        text = "- " + " ".join(rng.choice(WORDS, size=int(rng.integers(3, 8))))
+        cv2.putText(slide, text, (80, y), font, 1.1, (20, 20, 20), 2, cv2.LINE_AA)
+        y += int(rng.integers(55, 70))
+    return slide
+
+
+def photograph(slide, rng, size=(1600, 1200), noise=8.0):
+    """Слайд на фоне «аудитории» со случайной перспективой."""
+    out_w, out_h = size
+    sh, sw = slide.shape[:2]
+
+    # фон: вертикальный градиент
+    bg = np.linspace(40, 90, out_h, dtype=np.float32)[:, None, None]
+    photo = np.repeat(np.repeat(bg, out_w, axis=1), 3, axis=2).astype(np.uint8)
+
+    # углы слайда: центрированный прямоугольник с дрожанием
+    mw, mh = out_w * 0.12, out_h * 0.15
+    base = np.float32([[mw, mh], [out_w - mw, mh], [out_w - mw, out_h - mh], [mw, out_h - mh]])
+    jitter = rng.uniform(-0.07, 0.07, size=(4, 2)) * np.float32([out_w, out_h])
+    quad = (base + jitter).astype(np.float32)
+
+    src = np.float32([[0, 0], [sw, 0], [sw, sh], [0, sh]])
+    m = cv2.getPerspectiveTransform(src, quad)
+    cv2.warpPerspective(slide, m, (out_w, out_h), dst=photo, borderMode=cv2.BORDER_TRANSPARENT)
+
+    photo = cv2.GaussianBlur(photo, (3, 3), 0)
+    photo = photo.astype(np.float32) + rng.normal(0, noise, size=photo.shape)
+    return np.clip(photo, 0, 255).astype(np.uint8), quad
+
+
+def generate(out_dir, count, seed=0, size=(1600, 1200), repeats=1):
+    """repeats - снимков каждого слайда подряд (пересъёмка, с новой перспективой и шумом)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in out_dir.glob("slide_*.jpg"):
+        old.unlink()
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    slide = None
+    for i in range(count):
+        if i % max(1, repeats) == 0:
+            slide = make_slide(rng)
+        photo, _ = photograph(slide, rng, size=size)
+        path = out_dir / f"slide_{i:04d}.jpg"
+        cv2.imwrite(str(path), photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+def parse_size(s):
+    w, h = s.lower().split("x")
+    return int(w), int(h)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", default="bench/out/slides")
+    ap.add_argument("--count", type=int, default=24)
+    ap.add_argument("--size", default="1600x1200", help="размер «фотографии», WxH")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeats", type=int, default=1, help="снимков каждого слайда")
+    args = ap.parse_args()
+
+    paths = generate(args.out, args.count, seed=args.seed, size=parse_size(args.size), repeats=args.repeats)
+    print(f"[ok] {len(paths)} slides -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
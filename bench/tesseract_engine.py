@@ -0,0 +1,87 @@
+"""
+Tesseract: pytesseract (процесс на кроп) против tesserocr (хэндлы в памяти воркера).
+
+Печатает мс/кроп для обоих движков и число кропов, где текст различается
+(ожидается 0 - конфигурация одинаковая).
+
+Из корня репозитория:
+    python bench/tesseract_engine.py                       # синтетические строки текста
+    python bench/tesseract_engine.py --crops src/cache/img01/class_cutter --cls 0
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import synth
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from baseOCR2_worker import BaceOCRWorker  # noqa: E402
+
+
+IMG_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+def synthetic_crops(count, seed=0):
+    rng = np.random.default_rng(seed)
+    crops = []
+    for i in range(count):
+        text = " ".join(rng.choice(synth.WORDS, size=int(rng.integers(3, 8))))
+        img = np.full((60, 40 + 22 * len(text), 3), 248, dtype=np.uint8)
+        cv2.putText(img, text, (20, 42), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (20, 20, 20), 2, cv2.LINE_AA)
+        crops.append((f"synthetic_{i}", img))
+    return crops
+
+
+def load_crops(crops_dir):
+    out = []
+    for p in sorted(Path(crops_dir).iterdir()):
+        if p.suffix.lower() in IMG_EXTS:
+            img = cv2.imread(str(p), cv2.IMREAD_COLOR)
+            if img is not None:
+                out.append((p.name, img))
+    return out
+
+
+def run(worker, crops, cls_id):
+    texts = []
+    t0 = time.perf_counter()
+    for _, img in crops:
+        texts.append(worker.ocr_tesseract(img, cls_id=cls_id).strip())
+    return texts, (time.perf_counter() - t0) * 1000 / len(crops)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--crops", default=None, help="директория с кропами (по умолчанию - синтетика)")
+    ap.add_argument("--count", type=int, default=30)
+    ap.add_argument("--cls", choices=("0", "1"), default="0", help="0 - печатный текст (psm 6), 1 - рукописный (psm 3)")
+    args = ap.parse_args()
+
+    crops = load_crops(args.crops) if args.crops else synthetic_crops(args.count)
+    if not crops:
+        raise FileNotFoundError(f"no crops in {args.crops}")
+
+    results = {}
+    for engine in ("cli", "api"):
+        worker = BaceOCRWorker()
+        worker.init_tesseract(engine)
+        worker.ocr_tesseract(crops[0][1], cls_id=args.cls)  # прогрев
+        results[engine] = run(worker, crops, args.cls)
+        worker.on_shutdown()
+        print(f"{engine}: {results[engine][1]:.1f} ms/crop ({len(crops)} crops)")
+
+    diff = [name for (name, _), a, b in zip(crops, results["cli"][0], results["api"][0]) if a != b]
+    print(f"speedup: {results['cli'][1] / results['api'][1]:.2f}x, different texts: {len(diff)}")
+    for name in diff[:10]:
+        print(f"  {name}")
+
+
+if __name__ == "__main__":
+    main()
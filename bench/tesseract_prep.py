@@ -0,0 +1,119 @@
+"""
+Предобработка печатного текста для Tesseract: адаптивная (prep_tesseract_printed)
+против прежней фиксированной (2x, bilateral d=7, median 31).
+
+На отрисованных строках разной высоты печатает мс/кроп предобработки,
+мс/кроп вместе с распознаванием и CER (character error rate) - последние два,
+если установлен tesseract.
+
+Из корня репозитория:
+    python bench/tesseract_prep.py --heights 12,20,30,45,60 --per-height 10
+"""
+import argparse
+import shutil
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import synth
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from baseOCR2_worker import BaceOCRWorker  # noqa: E402
+
+
+def render_line(text, glyph_h, rng):
+    """Строка текста с высотой заглавных ~glyph_h px, лёгкий шум и размытие как на фото слайда."""
+    scale = glyph_h / 22.0  # FONT_HERSHEY_SIMPLEX: ~22 px при scale=1
+    thickness = max(1, int(round(scale * 2)))
+    (tw, th), base = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    pad = max(8, glyph_h // 2)
+    img = np.full((th + base + 2 * pad, tw + 2 * pad, 3), 245, dtype=np.uint8)
+    cv2.putText(img, text, (pad, pad + th), cv2.FONT_HERSHEY_SIMPLEX, scale, (25, 25, 25), thickness, cv2.LINE_AA)
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    noisy = img.astype(np.float32) + rng.normal(0, 6, size=img.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def levenshtein(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def cer(pred, truth):
+    pred, truth = " ".join(pred.split()), " ".join(truth.split())
+    return levenshtein(pred, truth) / max(1, len(truth))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--heights", default="12,16,24,32,48,64", help="высоты символов, px")
+    ap.add_argument("--per-height", type=int, default=10)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no-ocr", action="store_true", help="только время предобработки")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    worker = BaceOCRWorker()
+    ocr = not args.no_ocr and shutil.which("tesseract") is not None
+    if ocr:
+        worker.init_tesseract()
+    else:
+        print("[warn] tesseract not found: CER and OCR time are skipped")
+
+    preps = {"fixed": worker.prep_tesseract_printed_fixed, "adaptive": worker.prep_tesseract_printed}
+    print(f"{'height':>6} {'prep':>9} {'prep ms':>8} {'px out':>8} {'ocr ms':>8} {'CER':>7}")
+    totals = {name: {"prep": [], "ocr": [], "cer": []} for name in preps}
+    for glyph_h in [int(h) for h in args.heights.split(",") if h.strip()]:
+        lines = []
+        for _ in range(args.per_height):
+            text = " ".join(rng.choice(synth.WORDS, size=int(rng.integers(3, 7))))
+            lines.append((text, render_line(text, glyph_h, rng)))
+
+        for name, prep in preps.items():
+            prep_ms, ocr_ms, errs, px = [], [], [], []
+            for text, img in lines:
+                t0 = time.perf_counter()
+                bin_img = prep(img)
+                prep_ms.append((time.perf_counter() - t0) * 1000)
+                px.append(bin_img.size)
+                if ocr:
+                    t0 = time.perf_counter()
+                    if worker.tesseract is not None:
+                        pred = worker.tesseract.image_to_string(bin_img, lang="rus+eng", psm=6)
+                    else:
+                        import pytesseract
+                        pred = pytesseract.image_to_string(
+                            bin_img, lang="rus+eng", config="--oem 3 --psm 6 -c preserve_interword_spaces=1")
+                    ocr_ms.append((time.perf_counter() - t0) * 1000)
+                    errs.append(cer(pred, text))
+
+            totals[name]["prep"] += prep_ms
+            totals[name]["ocr"] += ocr_ms
+            totals[name]["cer"] += errs
+            print(f"{glyph_h:>6} {name:>9} {statistics.mean(prep_ms):>8.2f} {int(statistics.mean(px)):>8} "
+                  f"{(f'{statistics.mean(ocr_ms):.1f}' if ocr_ms else '-'):>8} "
+                  f"{(f'{statistics.mean(errs):.4f}' if errs else '-'):>7}")
+
+    print()
+    for name, t in totals.items():
+        line = f"{name}: prep {statistics.mean(t['prep']):.2f} ms/crop"
+        if t["ocr"]:
+            line += f", ocr {statistics.mean(t['ocr']):.1f} ms/crop, CER {statistics.mean(t['cer']):.4f}"
+        print(line)
+    worker.on_shutdown()
+
+
+if __name__ == "__main__":
+    main()
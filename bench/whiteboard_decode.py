@@ -0,0 +1,179 @@
+"""
+Стадия 1 (WhiteboadWorker): полный кадр для детекции и две конвертации цвета (до)
+против уменьшенного при декодировании кадра для детекции и warp из BGR (после).
+
+Печатает мс на изображение (медиана), пиковый объём массивов numpy/cv2 на изображение
+(tracemalloc) и пиковый RSS процесса; каждый вариант - в отдельном процессе.
+Без --weights вместо YOLO - заглушка: маска слайда порогом яркости на кадре 640
+(синтетические слайды светлые на тёмном фоне) и --model-ms задержки на кадр.
+Выигрыш зависит от соотношения времени модели и полного декодирования: полный кадр
+декодируется параллельно с моделью, поэтому при быстрой модели (GPU, --model-ms 0)
+лишнее уменьшенное декодирование может не окупиться.
+
+Из корня репозитория:
+    python bench/whiteboard_decode.py --count 12 --size 4000x3000 --model-ms 150
+    python bench/whiteboard_decode.py --images src/images --weights weights/whiteboard/best.pt --reduction 4
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import synth
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import yolo_backend  # noqa: E402
+from whiteboard_worker import WhiteboadWorker  # noqa: E402
+from worker_base import peak_rss_mb  # noqa: E402
+
+
+IMG_EXTS = {".jpg", ".jpeg"}
+
+
+class _Array:
+    # интерфейс тензора, который нужен _select_detection_index / _quad_for_index
+    def __init__(self, a):
+        self.a = np.asarray(a)
+        self.shape = self.a.shape
+
+    def __getitem__(self, i):
+        return _Array(self.a[i])
+
+    def detach(self):
+        return self
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.a
+
+    def argmax(self):
+        return int(self.a.argmax())
+
+
+class _Pred:
+    def __init__(self, mask):
+        self.boxes = type("Boxes", (), {"cls": _Array([0.0]), "conf": _Array([1.0])})()
+        self.masks = type("Masks", (), {"data": _Array(mask[None])})()
+
+
+class ThresholdModel:
+    name = "threshold-standin"
+
+    def __init__(self, model_ms):
+        self.model_ms = model_ms
+
+    def predict(self, imgs, conf, iou):
+        preds = []
+        for img in imgs:
+            # время модели: как onnxruntime, не держит GIL
+            time.sleep(self.model_ms / 1000)
+            boxed, (top, left, h, w) = yolo_backend.letterbox(img, (640, 640))
+            gray = cv2.cvtColor(boxed[top:top + h, left:left + w], cv2.COLOR_BGR2GRAY)
+            mask = cv2.morphologyEx((gray > 150).astype(np.uint8), cv2.MORPH_CLOSE, np.ones((9, 9), np.uint8))
+            preds.append(_Pred(mask.astype(np.float32)))
+        return preds
+
+
+def legacy_handle(worker, payload):
+    """Как было до уменьшенного декодирования: полный кадр в модель, RGB для warp и обратно в BGR."""
+    img = worker._read(payload)
+    pred = worker._predict(img)
+    H, W = img.shape[:2]
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    idx = worker._select_detection_index(pred, target_class=payload["target_class"])
+    src = worker._order_points_tl_tr_br_bl(worker._quad_for_index(pred, idx=idx, W=W, H=H))
+    warp_rgb = worker._warp_perspective(img_rgb, src)
+    warp_bgr = cv2.cvtColor(warp_rgb, cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(payload["out_path"], warp_bgr):
+        raise RuntimeError(f"failed to write image: {payload['out_path']}")
+    return {"warp_path": payload["out_path"]}
+
+
+def run_variant(args):
+    worker = WhiteboadWorker()
+    worker.model = yolo_backend.load_yolo(args.weights) if args.weights else ThresholdModel(args.model_ms)
+    worker.decoder = ThreadPoolExecutor(max_workers=1)
+    paths = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in IMG_EXTS)[:args.count]
+    reduction = 1 if args.variant == "before" else args.reduction
+
+    times, peaks = [], []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for i, path in enumerate([paths[0]] + paths):  # первый проход - прогрев
+            payload = {
+                "image_path": str(path),
+                "out_path": str(Path(out_dir) / f"warp_{path.name}"),
+                "target_class": 0,
+                "decode_reduction": reduction,
+                "transport": "file",
+            }
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            if args.variant == "before":
+                legacy_handle(worker, payload)
+            else:
+                worker.handle("do", payload)
+            dt = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if i:
+                times.append(dt * 1000)
+                peaks.append(peak / 2 ** 20)
+
+    worker.on_shutdown()
+    print(json.dumps({
+        "ms": round(statistics.median(times), 2),
+        "alloc_mb": round(statistics.median(peaks), 1),
+        "rss_mb": peak_rss_mb(),
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--images", default=None, help="директория с JPEG (по умолчанию - синтетика)")
+    ap.add_argument("--count", type=int, default=12)
+    ap.add_argument("--size", default="4000x3000", help="размер синтетических «фотографий», WxH")
+    ap.add_argument("--weights", default=None, help="best.pt whiteboard (иначе - заглушка)")
+    ap.add_argument("--model-ms", type=float, default=150, help="задержка заглушки модели, мс на кадр")
+    ap.add_argument("--reduction", type=int, choices=(1, 2, 4, 8), default=4)
+    ap.add_argument("--variant", choices=("before", "after"), default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.variant:
+        run_variant(args)
+        return
+
+    if args.images is None:
+        args.images = str(ROOT / "bench" / "out" / "decode_slides")
+        synth.generate(args.images, args.count, size=synth.parse_size(args.size))
+
+    results = {}
+    for variant in ("before", "after"):
+        cmd = [sys.executable, __file__, "--variant", variant, "--images", args.images,
+               "--count", str(args.count), "--reduction", str(args.reduction), "--model-ms", str(args.model_ms)]
+        if args.weights:
+            cmd += ["--weights", args.weights]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results[variant] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{'':<8} {'ms/img':>8} {'alloc MB/img':>13} {'peak RSS MB':>12}")
+    for variant, r in results.items():
+        print(f"{variant:<8} {r['ms']:>8} {r['alloc_mb']:>13} {r['rss_mb']:>12}")
+    print(f"speedup: {results['before']['ms'] / results['after']['ms']:.2f}x (reduction 1/{args.reduction})")
+
+
+if __name__ == "__main__":
+    main()
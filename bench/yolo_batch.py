@@ -0,0 +1,84 @@
+"""
+Пропускная способность YOLO (изображений/с) в зависимости от размера батча.
+
+Из корня репозитория:
+    python bench/yolo_batch.py --model whiteboard --images src/images --device cpu
+    python bench/yolo_batch.py --model class_cutter --batch-sizes 1,2,4,8,16
+
+Без --images используются синтетические кадры 1280x960.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+
+ROOT = Path(__file__).resolve().parent.parent
+IMG_EXTS = {".jpg", ".jpeg", ".png"}
+CONF = {"whiteboard": 0.25, "class_cutter": 0.3}
+
+
+def load_images(images_dir, count):
+    if images_dir is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, size=(960, 1280, 3), dtype=np.uint8) for _ in range(count)]
+
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMG_EXTS)
+    imgs = [cv2.imread(str(p), cv2.IMREAD_COLOR) for p in paths[:count]]
+    imgs = [img for img in imgs if img is not None]
+    if not imgs:
+        raise FileNotFoundError(f"no images in {images_dir}")
+    # добиваем до count повторами, чтобы батчи были полными
+    while len(imgs) < count:
+        imgs.extend(imgs[:count - len(imgs)])
+    return imgs
+
+
+def bench(model, imgs, batch_size, device, conf, repeats):
+    def _run():
+        for i in range(0, len(imgs), batch_size):
+            model.predict(source=imgs[i:i + batch_size], conf=conf, iou=0.5,
+                          device=device, save=False, verbose=False)
+
+    _run()  # прогрев
+    best = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        _run()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return len(imgs) / best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", choices=sorted(CONF), default="whiteboard")
+    ap.add_argument("--images", default=None, help="директория с изображениями (по умолчанию - синтетика)")
+    ap.add_argument("--count", type=int, default=32, help="изображений на один прогон")
+    ap.add_argument("--batch-sizes", default="1,2,4,8,16")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--repeats", type=int, default=3)
+    args = ap.parse_args()
+
+    weights = ROOT / "weights" / args.model / "best.pt"
+    if not weights.exists():
+        raise FileNotFoundError(f"Weights not found: {weights}")
+
+    model = YOLO(str(weights))
+    imgs = load_images(args.images, args.count)
+    batch_sizes = [int(x) for x in args.batch_sizes.split(",") if x.strip()]
+
+    print(f"model={args.model} device={args.device} images={len(imgs)}")
+    print(f"{'batch':>6}  {'img/s':>8}  {'speedup':>7}")
+    base = None
+    for bs in batch_sizes:
+        ips = bench(model, imgs, bs, args.device, CONF[args.model], args.repeats)
+        base = base or ips
+        print(f"{bs:>6}  {ips:>8.2f}  {ips / base:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,192 @@
+import os
+import threading
 import cv2
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 import pytesseract
-import easyocr
 from pathlib import Path
-from worker_base import BaseWorker
+from worker_base import BaseWorker, timed_import
+from tesseract_pool import TesseractPool, api_available
+from shm_frames import get_frame
+from tracing import span, traced
+
+
+ROUTE_PREP = {"ocr_printed": "0", "ocr_handwritten": "1"}    # маршрут кропа (CLASS_ROUTES в core.py) -> предобработка
+PREP_TARGET_TEXT_HEIGHT = 32    # высота символов (px), при которой tesseract распознаёт лучше всего
+
+
+def _odd(v):
+    v = int(round(v))
+    return v if v % 2 else v + 1
+
+
+def estimate_text_height(gray):
+    """Медианная высота символов по компонентам связности тёмного текста; None - символов не нашлось."""
+    ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    n, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    H, W = gray.shape[:2]
+    hs = [
+        stats[i, cv2.CC_STAT_HEIGHT] for i in range(1, n)
+        # шум, линии рамок и заливки - не символы
+        if 4 <= stats[i, cv2.CC_STAT_HEIGHT] <= 0.8 * H
+        and stats[i, cv2.CC_STAT_WIDTH] <= 0.5 * W
+        and stats[i, cv2.CC_STAT_AREA] >= 8
+    ]
+    if len(hs) < 3:
+        return None
+    return float(np.median(hs))
+
+
+def pack_crops(imgs, max_side=2560, gap=16):
+    """
+    Раскладка кропов полками на белые холсты не больше max_side (canvas_size EasyOCR).
+    Расстояние по горизонтали - не меньше высоты полки, чтобы EasyOCR
+    не склеил рамки текста соседних кропов (width_ths = 0.5 высоты).
+    Возвращает [(canvas, [(idx, x, y), ...]), ...].
+    """
+    order = sorted(range(len(imgs)), key=lambda i: imgs[i].shape[0], reverse=True)
+    total = sum(img.shape[0] * img.shape[1] for img in imgs)
+    max_w = max(img.shape[1] for img in imgs)
+    width = min(max_side, max(max_w, int(total ** 0.5)))
+
+    pages = []
+    places, x, y, shelf_h, page_w = [], 0, 0, 0, 0
+    for i in order:
+        h, w = imgs[i].shape[:2]
+        if x > 0 and x + w > width:
+            x, y, shelf_h = 0, y + shelf_h + gap, 0
+        if places and y + h > max_side:
+            pages.append((places, page_w, y - gap if x == 0 else y + shelf_h))
+            places, x, y, shelf_h, page_w = [], 0, 0, 0, 0
+        places.append((i, x, y))
+        shelf_h = max(shelf_h, h)
+        page_w = max(page_w, x + w)
+        x += w + max(gap, shelf_h)
+    pages.append((places, page_w, y + shelf_h))
+
+    out = []
+    for places, w, h in pages:
+        canvas = np.full((h, w, 3), 255, dtype=np.uint8)
+        for i, x, y in places:
+            ih, iw = imgs[i].shape[:2]
+            canvas[y:y + ih, x:x + iw] = imgs[i]
+        out.append((canvas, places))
+    return out
+
+
+def crop_box(img, box):
+    """box - (x1, y1, x2, y2) в пикселях слайда от class cutter;  None - весь слайд."""
+    if box is None:
+        return img
+    x1, y1, x2, y2 = box
+    return img[y1:y2, x1:x2]
+
 
 class BaceOCRWorker(BaseWorker):
+    def __init__(self):
+        super().__init__()
+        self.easyocr_reader = None
+        self.tesseract = None  # TesseractPool;  None - pytesseract (процесс tesseract на каждый кроп)
+        self.engines = {}  # в MODE 2 движки работают одновременно, у каждого своя очередь (executor)
+        self._slide = None  # (ключ, кадр) - последний декодированный слайд, кропы вырезаются из него
+        self._slide_lock = threading.Lock()
+
+
     def on_start(self):
+        # импорт здесь: tesseract-часть воркера используется и без easyocr/torch (bench/pipeline.py)
+        with timed_import():
+            import easyocr
         self.easyocr_reader = easyocr.Reader(['ru', 'en'], gpu=True)
-        return {"name": "baseOCR-worker", "ready": True}
+        engine = self.init_tesseract()
+
+        threads = int(os.environ.get("CONSPECT_WORKER_THREADS", "1"))
+        self.engines = {
+            # хэндлов tesseract столько, сколько потоков; easyocr - один поток, модель не делится
+            "tesseract": ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="tesseract"),
+            "easyocr": ThreadPoolExecutor(max_workers=1, thread_name_prefix="easyocr"),
+        }
+        return {"name": "baseOCR-worker", "ready": True, "tesseract_engine": engine}
+
+
+    def init_tesseract(self, engine=None):
+        engine = engine or os.environ.get("CONSPECT_TESSERACT_ENGINE", "auto")
+        if engine == "auto":
+            engine = "api" if api_available() else "cli"
+        if engine == "api":
+            self.tesseract = TesseractPool(oem=3, variables={"preserve_interword_spaces": 1})
+        elif engine != "cli":
+            raise ValueError(f"unknown tesseract engine: {engine}")
+        return engine
+
+
+    def warmup(self):
+        blank = np.full((64, 256, 3), 255, dtype=np.uint8)
+        # хэндлы tesseract для обоих psm создаются здесь, а не на первом кропе
+        self.ocr_tesseract(blank, cls_id="0")
+        self.ocr_tesseract(blank, cls_id="1")
+        self.ocr_easyocr(blank)
 
 
     def ocr_easyocr(self, img):
-        result = self.easyocr_reader.readtext(img, detail=0, paragraph=True)
+        with span("readtext"):
+            result = self.easyocr_reader.readtext(img, detail=0, paragraph=True)
         text = "\n".join(result)
         return text
 
 
+    def ocr_easyocr_batch(self, imgs, batch_size=16):
+        """
+        Кропы одного слайда за один проход: детектор - один раз на холст с разложенными кропами,
+        распознаватель - батчами по batch_size строк. Рамки возвращаются кропам по центру,
+        абзацы собираются так же, как readtext(paragraph=True) на отдельном кропе.
+        """
+        from easyocr.utils import get_paragraph
+
+        found = [[] for _ in imgs]
+        for canvas, places in pack_crops(imgs):
+            with span("readtext", crops=len(places)):
+                result = self.easyocr_reader.readtext(canvas, detail=1, paragraph=False, batch_size=batch_size)
+            for box, text, conf in result:
+                cx = sum(p[0] for p in box) / 4
+                cy = sum(p[1] for p in box) / 4
+                for i, x, y in places:
+                    h, w = imgs[i].shape[:2]
+                    if x <= cx < x + w and y <= cy < y + h:
+                        found[i].append(([[px - x, py - y] for px, py in box], text, conf))
+                        break
+
+        return ["\n".join(item[1] for item in get_paragraph(res, x_ths=1.0, y_ths=0.5)) if res else ""
+                for res in found]
+
+
+    @traced()
     def prep_tesseract_printed(self, img):
+        """
+        Масштаб и ядра фильтров подбираются по высоте текста: мелкий текст увеличивается
+        до ~PREP_TARGET_TEXT_HEIGHT пикселей (не больше чем в 2 раза), крупный не увеличивается.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        text_h = estimate_text_height(gray)
+        if text_h is None:
+            scale = 2.0
+        else:
+            scale = min(2.0, max(1.0, PREP_TARGET_TEXT_HEIGHT / text_h))
+        scaled_h = (text_h or PREP_TARGET_TEXT_HEIGHT / 2) * scale
+
+        if scale > 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        # ядра - от высоты текста после масштабирования (для ~16 px текста при 2x - близко к прежним 7 и 31)
+        d = _odd(min(9, max(5, scaled_h / 4.5)))
+        k = _odd(min(61, max(15, scaled_h)))
+        gray = cv2.bilateralFilter(gray, d=d, sigmaColor=40, sigmaSpace=40)
+        bg = cv2.medianBlur(gray, k)
+        norm = cv2.divide(gray, bg, scale=255)
+        otsu = cv2.threshold(norm, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        return otsu
+
+
+    def prep_tesseract_printed_fixed(self, img):
+        """Прежняя фиксированная предобработка (2x, d=7, median 31) - для сравнения в bench/tesseract_prep.py."""
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         gray = cv2.resize(gray, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_CUBIC)
         gray = cv2.bilateralFilter(gray, d=7, sigmaColor=40, sigmaSpace=40)
@@ -26,83 +196,278 @@ class BaceOCRWorker(BaseWorker):
         return otsu
 
 
+    @traced()
     def prep_tesseract_handwritten(self, img):
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
         return otsu
 
 
-    def ocr_tesseract(self, img, cls_id, lang="rus+eng"):
+    def _prep_tesseract(self, img, cls_id):
         if cls_id == "0":
-            bin_img = self.prep_tesseract_printed(img)
-            psm = 6
+            return self.prep_tesseract_printed(img), 6
         elif cls_id == "1":
-            bin_img = self.prep_tesseract_handwritten(img)
-            psm = 3
+            return self.prep_tesseract_handwritten(img), 3
+        raise ValueError(f"unknown cls_id for tesseract: {cls_id}")
+
+
+    def ocr_tesseract(self, img, cls_id, lang="rus+eng"):
+        bin_img, psm = self._prep_tesseract(img, cls_id)
+
+        if self.tesseract is not None:
+            with span("tesserocr.GetUTF8Text", psm=psm):
+                return self.tesseract.image_to_string(bin_img, lang=lang, psm=psm)
 
         cfg = f'--oem 3 --psm {psm} -c preserve_interword_spaces=1'
-        text = pytesseract.image_to_string(bin_img, lang=lang, config=cfg)
+        with span("pytesseract.image_to_string", psm=psm):
+            text = pytesseract.image_to_string(bin_img, lang=lang, config=cfg)
         return text
 
 
-    def _parse_ids(self, img_path):
-        stem = Path(img_path).stem
-        parts =stem.split("_")
-        if len(parts) < 2:
-            raise ValueError(f"bad filename format (expected [img_id]_[cls_id])")
+    def ocr_tesseract_conf(self, img, cls_id, lang="rus+eng"):
+        """Текст и средняя уверенность tesseract по словам (0-100; без слов - 0)."""
+        bin_img, psm = self._prep_tesseract(img, cls_id)
+
+        if self.tesseract is not None:
+            with span("tesserocr.AllWordConfidences", psm=psm):
+                text, confs = self.tesseract.image_to_data(bin_img, lang=lang, psm=psm)
+        else:
+            cfg = f'--oem 3 --psm {psm} -c preserve_interword_spaces=1'
+            with span("pytesseract.image_to_data", psm=psm):
+                data = pytesseract.image_to_data(bin_img, lang=lang, config=cfg, output_type=pytesseract.Output.DICT)
+            text, confs = self._text_from_data(data)
+
+        conf = sum(confs) / len(confs) if confs else 0.0
+        return text, conf
+
 
-        img_id = parts[0]
-        cls_id = parts[1]
+    def _text_from_data(self, data):
+        # строки - по (block, par, line), абзацы - через пустую строку, как в image_to_string
+        lines, confs = [], []
+        prev_par = None
+        for i, word in enumerate(data["text"]):
+            conf = float(data["conf"][i])
+            if conf < 0 or not word.strip():
+                continue
+            confs.append(conf)
+            par = (data["block_num"][i], data["par_num"][i])
+            line = par + (data["line_num"][i],)
+            if lines and lines[-1][0] == line:
+                lines[-1][1].append(word)
+                continue
+            if prev_par is not None and par != prev_par:
+                lines.append((None, []))
+            lines.append((line, [word]))
+            prev_par = par
+        return "\n".join(" ".join(words) for _, words in lines), confs
 
-        if (img_id or cls_id) == 'FAILED':
-            img_id = '0'
-            cls_id = '0'
 
-        return img_id, cls_id
+    def should_escalate(self, text, conf, cascade):
+        """MODE 3: кроп уходит в easyocr при низкой уверенности или неправдоподобном тексте."""
+        chars = [c for c in text if not c.isspace()]
+        if not chars:
+            return True
+        plausibility = sum(c.isalnum() for c in chars) / len(chars)
+        return conf < cascade["min_conf"] or plausibility < cascade["min_plausibility"]
 
 
-    def _process_image(self, img, img_path, mode):
-        img_id, cls_id = self._parse_ids(img_path)
-        if mode not in (0, 1, 2):
-            raise ValueError("mode must be 0 (tesseract), 1 (easyocr), or 2 (both)")
+    def _cls_id(self, payload):
+        # предобработка tesseract: "0" - печатный текст, "1" - рукописный
+        route = payload.get("route", "ocr_printed")
+        if route not in ROUTE_PREP:
+            raise ValueError(f"not an OCR route: {route}")
+        return ROUTE_PREP[route]
+
+
+    def _process_image(self, img, cls_id, mode, cascade=None):
+        if mode not in (0, 1, 2, 3):
+            raise ValueError("mode must be 0 (tesseract), 1 (easyocr), 2 (both) or 3 (cascade)")
 
         t_text = ""
         e_text = ""
 
-        if mode in (0, 2):
-            t_text = self.ocr_tesseract(img, cls_id=cls_id, lang='rus+eng')
-        if mode in (1, 2):
+        if mode == 3:
+            t_text, conf = self.ocr_tesseract_conf(img, cls_id=cls_id, lang='rus+eng')
+            escalated = self.should_escalate(t_text, conf, cascade)
+            if escalated:
+                e_text = self.ocr_easyocr(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            return {
+                "cls_id": cls_id,
+                "tesseract_text": t_text.strip(),
+                "easyocr_text": e_text.strip(),
+                "tesseract_conf": round(conf, 2),
+                "escalated": escalated,
+            }
+
+        if mode == 2 and self.engines:
+            # время на кроп - max(tesseract, easyocr), а не сумма
             img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            e_text = self.ocr_easyocr(img_rgb)
+            t_fut = self.engines["tesseract"].submit(self.ocr_tesseract, img, cls_id, 'rus+eng')
+            e_fut = self.engines["easyocr"].submit(self.ocr_easyocr, img_rgb)
+            t_text, e_text = t_fut.result(), e_fut.result()
+        else:
+            if mode in (0, 2):
+                t_text = self.ocr_tesseract(img, cls_id=cls_id, lang='rus+eng')
+            if mode in (1, 2):
+                img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                e_text = self.ocr_easyocr(img_rgb)
 
         return {
-            "img_id": img_id,
             "cls_id": cls_id,
             "tesseract_text": t_text.strip(),
             "easyocr_text": e_text.strip(),
         }
 
 
-    def handle(self, op, payload):
-        if op != "do":
-            raise ValueError(f"unknown op: {op}")
+    def _slide_key(self, payload):
+        if payload.get("image"):
+            return "shm", payload["image"]["shm"], tuple(payload["image"]["shape"])
+        # сервер моделей переживает запуски: тот же путь может указывать на новый слайд
+        st = os.stat(payload["image_path"])
+        return "file", payload["image_path"], st.st_mtime_ns, st.st_size
 
+
+    def _read_slide(self, payload):
         image_path = payload["image_path"]
-        mode = payload["mode"]
+        try:
+            key = self._slide_key(payload)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"cannot read image: {image_path}")
+        with self._slide_lock:
+            if self._slide is not None and self._slide[0] == key:
+                return self._slide[1]
 
-        img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if payload.get("image"):
+            with span("get_frame"):
+                img = get_frame(payload["image"])
+        else:
+            with span("cv2.imread"):
+                img = cv2.imread(image_path, cv2.IMREAD_COLOR)
         if img is None:
             raise FileNotFoundError(f"cannot read image: {image_path}")
 
-        res = self._process_image(img, image_path, mode)
+        with self._slide_lock:
+            self._slide = (key, img)
+        return img
 
-        return {
+
+    def _read(self, payload):
+        """Кроп: слайд декодируется один раз на все его кропы, кроп - срез в памяти."""
+        return crop_box(self._read_slide(payload), payload.get("box"))
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        img = self._read(payload)
+        res = self._process_image(img, self._cls_id(payload), payload["mode"], payload.get("cascade"))
+
+        out = {
             "tesseract_text": res["tesseract_text"],
             "easyocr_text": res["easyocr_text"],
         }
+        if "escalated" in res:
+            out["tesseract_conf"] = res["tesseract_conf"]
+            out["escalated"] = res["escalated"]
+        return out
+
+
+    def handle_batch(self, op, payloads, imgs=None):
+        """
+        Кропы одного слайда: tesseract - по кропу, easyocr - одним батчем на все кропы.
+        MODE 3: сначала tesseract с уверенностями, затем одним батчем easyocr - только эскалированные кропы.
+        imgs - уже вырезанные кропы BGR (fused_worker.py);  None - читаются по payload.
+        """
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        out = [None] * len(payloads)
+        crops = {}
+        for i, payload in enumerate(payloads):
+            try:
+                if payload["mode"] not in (0, 1, 2, 3):
+                    raise ValueError("mode must be 0 (tesseract), 1 (easyocr), 2 (both) or 3 (cascade)")
+                img = self._read(payload) if imgs is None else imgs[i]
+                crops[i] = (img, self._cls_id(payload), payload["mode"])
+            except Exception as e:
+                out[i] = {"ok": False, "error": str(e)}
+
+        def _submit(engine, fn, *args):
+            ex = self.engines.get(engine)
+            if ex is not None:
+                return ex.submit(fn, *args)
+            fut = Future()
+            try:
+                fut.set_result(fn(*args))
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+
+        def _submit_easyocr(idxs):
+            if not idxs:
+                return None
+            batch_size = payloads[idxs[0]].get("easyocr_batch_size", 16)
+            imgs = [cv2.cvtColor(crops[i][0], cv2.COLOR_BGR2RGB) for i in idxs]
+            return _submit("easyocr", self.ocr_easyocr_batch, imgs, batch_size)
+
+        # в MODE 2 очереди движков работают одновременно
+        t_futs = {}
+        for i, (img, cls_id, mode) in crops.items():
+            if mode in (0, 2):
+                t_futs[i] = _submit("tesseract", self.ocr_tesseract, img, cls_id, 'rus+eng')
+            elif mode == 3:
+                t_futs[i] = _submit("tesseract", self.ocr_tesseract_conf, img, cls_id, 'rus+eng')
+        e_idxs = [i for i, (_, _, mode) in crops.items() if mode in (1, 2)]
+        e_fut = _submit_easyocr(e_idxs)
+
+        t_res, t_errors = {}, {}
+        for i, fut in t_futs.items():
+            try:
+                t_res[i] = fut.result()
+            except Exception as e:
+                t_errors[i] = str(e)
+
+        escalated = {}
+        for i, res in t_res.items():
+            if crops[i][2] == 3:
+                text, conf = res
+                escalated[i] = self.should_escalate(text, conf, payloads[i]["cascade"])
+        if escalated:
+            e_idxs = [i for i, esc in escalated.items() if esc]
+            e_fut = _submit_easyocr(e_idxs)
+
+        e_texts, e_error = {}, None
+        if e_fut is not None:
+            try:
+                e_texts = dict(zip(e_idxs, e_fut.result()))
+            except Exception as e:
+                e_error = str(e)
+
+        for i, (_, _, mode) in crops.items():
+            if i in t_errors:
+                out[i] = {"ok": False, "error": t_errors[i]}
+                continue
+            if i in e_idxs and e_error is not None:
+                out[i] = {"ok": False, "error": e_error}
+                continue
+            res = t_res.get(i, "")
+            t_text = res[0] if mode == 3 else res
+            payload = {"tesseract_text": t_text.strip(), "easyocr_text": e_texts.get(i, "").strip()}
+            if mode == 3:
+                payload["tesseract_conf"] = round(res[1], 2)
+                payload["escalated"] = escalated[i]
+            out[i] = {"ok": True, "payload": payload}
+        return out
 
 
     def on_shutdown(self):
+        for ex in self.engines.values():
+            ex.shutdown(wait=True)
+        self.engines = {}
+        self._slide = None
+        if self.tesseract is not None:
+            self.tesseract.close()
         return {"bye": True}
 
 if __name__ == "__main__":
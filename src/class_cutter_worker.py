@@ -1,8 +1,11 @@
 import cv2
+import numpy as np
 from pathlib import Path
-from ultralytics import YOLO
 
 from worker_base import BaseWorker
+from yolo_backend import load_yolo
+from shm_frames import get_frame
+from tracing import span, traced
 
 class ClassCutterWorker(BaseWorker):
     def __init__(self):
@@ -13,22 +16,25 @@ class ClassCutterWorker(BaseWorker):
     def on_start(self):
         HERE = Path(__file__).resolve().parent
         weights = HERE.parent / 'weights' / 'class_cutter' / 'best.pt'
-        if not weights.exists():
-            raise FileNotFoundError(f"Weights not found: {weights}")
 
-        self.model = YOLO(str(weights))
-        return {"name": "class_cutter-worker", "ready": True}
+        self.model = load_yolo(weights)
+        return {"name": "class_cutter-worker", "ready": True, "backend": self.model.name}
 
 
-    def _process_image(self, img):
-        pred = self.model.predict(
-            source=img,
-            conf=0.3,
-            iou=0.5,
-            device="cuda",
-            save=False,
-            verbose=False
-        )[0]
+    def warmup(self):
+        self._predict_batch([np.zeros((640, 640, 3), dtype=np.uint8)])
+
+
+    @traced("_predict")
+    def _predict_batch(self, imgs):
+        preds = self.model.predict(imgs, conf=0.3, iou=0.5)
+        return preds
+
+
+    def _process_image(self, img, pred=None, classes=None):
+        """classes - классы, у которых есть потребитель (CLASS_ROUTES в core.py);  None - все."""
+        if pred is None:
+            pred = self._predict_batch([img])[0]
 
         if len(pred.boxes) == 0:
             raise RuntimeError("no detections")
@@ -38,14 +44,16 @@ class ClassCutterWorker(BaseWorker):
 
         # 0: 'text', 1: 'handwritten text', 2: 'formula', 3: 'scheme',
         # 4: 'image', 5: 'graph', 6: 'table', 7: 'interface'
-        target_cls = (0, 1, 2, 3, 4, 5, 6)
+        target_cls = set(classes) if classes is not None else set(cls.tolist())
 
         h, w = img.shape[:2]
         line_tol = max(12, int(0.02 * h))
 
         items = []
+        routed_out = False
         for b, c in zip(xyxy, cls):
             if c not in target_cls:
+                routed_out = True
                 continue
             x1, y1, x2, y2 = b.tolist()
             x1i = max(0, min(w - 1, int(round(x1))))
@@ -59,48 +67,82 @@ class ClassCutterWorker(BaseWorker):
             items.append((row, x1i, y1i, x2i, y2i, c))
 
         if not items:
+            if routed_out:
+                # на слайде только классы, которые никому не нужны (drop) - это не ошибка
+                return []
             raise RuntimeError("no detections for target_classes")
 
         items.sort(key=lambda t: (t[0], t[1]))
 
-        preds = []
-        for idx, (row, x1i, y1i, x2i, y2i, c) in enumerate(items, start=1):
-            crop = img[y1i:y2i, x1i:x2i]
-            preds.append({
-                "id": idx,
-                "cls": int(c),
-                "img": crop
-            })
-
-        return preds
+        # порядок чтения; кропы режет OCR-воркер из того же кадра
+        return [
+            {"id": idx, "cls": int(c), "box": [x1i, y1i, x2i, y2i]}
+            for idx, (row, x1i, y1i, x2i, y2i, c) in enumerate(items, start=1)
+        ]
 
 
-    def handle(self, op, payload):
-        if op != "do":
-            raise ValueError(f"unknown op: {op}")
+    def _read(self, payload):
+        if payload.get("image"):
+            with span("get_frame"):
+                return get_frame(payload["image"])
 
         image_path = payload["image_path"]
-        out_dir = payload["out_dir"]
-
-        src_img = cv2.imread(image_path, cv2.IMREAD_COLOR)
-        src_ext = image_path.split(".")[-1]
+        with span("cv2.imread"):
+            src_img = cv2.imread(image_path, cv2.IMREAD_COLOR)
         if src_img is None:
             raise FileNotFoundError(f"cannot read image: {image_path}")
+        return src_img
 
-        img_paths = []
-        preds = self._process_image(src_img)
-        for pred_img in preds:
-            img_id = pred_img["id"]
-            img_cls = pred_img["cls"]
-            img = pred_img["img"]
 
-            img_name = f'{img_id}_{img_cls}.{src_ext}'
-            out_file = f'{out_dir}/{img_name}'
-            img_paths.append(out_file)
+    def _finish(self, src_img, payload, pred=None):
+        boxes = self._process_image(src_img, pred=pred, classes=payload.get("classes"))
 
-            ok = cv2.imwrite(out_file, img)
+        figures = payload.get("figures") or {}
+        figure_cls = set(figures.get("classes", []))
+        for box in boxes:
+            if box["cls"] not in figure_cls:
+                continue
+            # рисунки - без потерь, в результат
+            x1, y1, x2, y2 = box["box"]
+            out_file = str(Path(figures["dir"]) / f'{figures["prefix"]}_{box["id"]}_{box["cls"]}.png')
+            with span("cv2.imwrite"):
+                ok = cv2.imwrite(out_file, src_img[y1:y2, x1:x2])
+            if not ok:
+                raise RuntimeError(f"failed to write image: {out_file}")
+            box["figure"] = out_file
+
+        return {"boxes": boxes}
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        src_img = self._read(payload)
+        return self._finish(src_img, payload)
+
+
+    def handle_batch(self, op, payloads):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
 
-        return {"img_paths": img_paths}
+        out = [None] * len(payloads)
+        imgs = {}
+        for i, payload in enumerate(payloads):
+            try:
+                imgs[i] = self._read(payload)
+            except Exception as e:
+                out[i] = {"ok": False, "error": str(e)}
+
+        idxs = list(imgs)
+        preds = self._predict_batch([imgs[i] for i in idxs]) if idxs else []
+
+        for i, pred in zip(idxs, preds):
+            try:
+                out[i] = {"ok": True, "payload": self._finish(imgs[i], payloads[i], pred=pred)}
+            except Exception as e:
+                out[i] = {"ok": False, "error": str(e)}
+        return out
 
 
     def on_shutdown(self):
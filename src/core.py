@@ -3,8 +3,21 @@ from dataclasses import dataclass
 from pathlib import Path
 import subprocess
 import sys
+import os
+import socket
 import json
-import copy
+import time
+
+import tracing
+from shm_frames import FRAME_FILE_EXT, load_frame, release_frame, save_frame
+from worker_daemon import socket_path
+from worker_base import peak_rss_mb
+import queue
+import threading
+import itertools
+import hashlib
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 IMG_EXTS = {".jpg", ".jpeg", ".png"}
@@ -14,8 +27,63 @@ WHEN_ERRORS_IN_WHITEBOARD_DELETE_DIR = False
 WHEN_ERRORS_IN_CLASSCUTTER_IGNORE_DIR = True
 DIR_WITH_IMAGES_FOR_ANALYZE = 'images'
 RESULT_SAVE_DIR = ''
-MODE = 0    # 0 - tesseract;  1 - easyocr;  2 - tesseract + easyocr
+MODE = 0    # 0 - tesseract;  1 - easyocr;  2 - tesseract + easyocr;  3 - tesseract, при низкой уверенности - easyocr
+OCR_CASCADE_MIN_CONF = 70    # MODE 3: средняя уверенность tesseract по словам (0-100), ниже - кроп уходит в easyocr
+OCR_CASCADE_MIN_PLAUSIBILITY = 0.6    # MODE 3: доля букв и цифр среди непробельных символов, ниже - в easyocr
+TESSERACT_ENGINE = 'auto'    # api - tesserocr, модели загружены один раз;  cli - pytesseract (процесс на кроп);  auto - api, если установлен tesserocr
 DELETE_CACHE_AFTER_COMPLETION = False
+FUSED_PIPELINE = False    # True - все стадии в одном процессе (fused_worker.py): один запрос на фотографию, для интерактивной работы
+PIPELINE_STREAMING = True    # True - все стадии работают одновременно, изображения идут через очереди
+STREAM_QUEUE_SIZE = 8    # максимум элементов в очереди между стадиями
+WHITEBOARD_WORKERS = 1    # число процессов-воркеров в каждой стадии
+CLASS_CUTTER_WORKERS = 1
+OCR_WORKERS = 1
+FUSED_WORKERS = 1    # процессов fused_worker.py при FUSED_PIPELINE
+MODEL_HOST_MODELS = ()    # стадии, модели которых грузятся в один процесс (model_host_worker.py), например ("whiteboard", "class_cutter");  () - процесс на стадию
+WORKER_WINDOW = 1    # сколько запросов держать в полёте на один воркер
+WORKER_THREADS = 1    # потоков обработки внутри воркера (только для потокобезопасных моделей)
+WHITEBOARD_BATCH_SIZE = 1    # изображений в одном батчевом запросе (do_batch) к YOLO
+CLASS_CUTTER_BATCH_SIZE = 1
+SLIDE_DEDUP = False    # подряд идущие снимки одного слайда (серии, пересъёмка) - текст берётся только с последнего, остальные ссылаются на него
+SLIDE_DEDUP_MAX_DISTANCE = 5    # порог похожести: различающихся бит из 256 в хэше выровненного слайда;  слайд с одной добавленной короткой строкой часто тоже ниже порога
+WHITEBOARD_DECODE_REDUCTION = 4    # детекция экрана по кадру, уменьшенному при декодировании JPEG (1, 2, 4, 8), warp - по полному;  1 - если модель на GPU быстрее декодирования
+OCR_BATCH_PER_SLIDE = True    # все кропы слайда - одним do_batch (EasyOCR распознаёт их одним батчевым вызовом)
+EASYOCR_BATCH_SIZE = 16    # строк в одном батче распознавателя EasyOCR
+IMAGE_TRANSPORT = 'shm'    # shm - кадры между стадиями через shared memory;  file - через файлы в кэше
+SAVE_INTERMEDIATE_IMAGES = False    # при shm дополнительно сохранять кадры в кэш (отладка)
+STAGE_CACHE_DIR = 'stage_cache'    # постоянный кэш результатов стадий по хэшу входа;  '' - выключен
+STAGE_CACHE_VERSION = 6    # увеличить, если меняется логика воркеров
+WORKER_DAEMON_DIR = ''    # директория сокетов worker_daemon.py;  '' - всегда запускать новые процессы
+PRINT_EVENTS = False    # печатать каждое событие воркеров (отладка)
+SUMMARY_FILENAME = 'run_summary.json'    # итоговый отчёт (JSON) рядом с result.txt;  '' - не сохранять
+TRACE_FILENAME = ''    # трасса всего запуска для Perfetto (например 'trace.json');  '' - выключена
+INFERENCE_BACKEND = 'auto'    # YOLO: auto - torch на CUDA, если есть, иначе onnxruntime на CPU;  torch;  onnx
+ONNX_INTRA_OP_THREADS = 0    # потоков onnxruntime внутри оператора (на воркер);  0 - по умолчанию
+ONNX_INTER_OP_THREADS = 0    # потоков onnxruntime между операторами;  0 - по умолчанию
+MODEL_PRECISION = {    # fp32;  fp16;  int8 (только onnx, статическая калибровка bench/quantization.py --calib-images, иначе fp32) - включать после замера
+    "whiteboard": "fp32",
+    "class_cutter": "fp32",
+}
+CLASS_ROUTES = {    # класс class cutter -> потребитель: ocr_printed;  ocr_handwritten;  figure - кроп в RESULT_SAVE_DIR/figures;  drop
+    0: "ocr_printed",    # text
+    1: "ocr_handwritten",    # handwritten text
+    2: "drop",    # formula
+    3: "drop",    # scheme
+    4: "drop",    # image
+    5: "drop",    # graph
+    6: "drop",    # table
+    7: "drop",    # interface
+}
+FIGURES_DIRNAME = 'figures'    # кропы с маршрутом figure: <RESULT_SAVE_DIR>/figures/<изображение>_<id>_<класс>.png
+WORKER_SCRIPTS = {    # скрипты воркеров стадий (bench/ подставляет сюда заглушки)
+    "whiteboard": "whiteboard_worker.py",
+    "class_cutter": "class_cutter_worker.py",
+    "ocr": "baseOCR2_worker.py",
+    "fused": "fused_worker.py",
+    "model_host": "model_host_worker.py",
+}
+
+HERE = Path(__file__).resolve().parent
 
 
 def print_settings(left_part_width=48):
@@ -55,6 +123,7 @@ def print_settings(left_part_width=48):
     print(f'{" " * left_part_width}  |  0 - tesseract')
     print(f'{" " * left_part_width}  |  1 - easyocr')
     print(f'{" " * left_part_width}  |  2 - tesseract + easyocr')
+    print(f'{" " * left_part_width}  |  3 - tesseract, при низкой уверенности - easyocr')
 
     print()
 
@@ -100,8 +169,8 @@ def configure():
                 new_prm = input('Введите новый путь директории с изображениями для анализа (путь относительно src/ ): ').strip()
                 RESULT_SAVE_DIR = new_prm
             elif num_prm_to_change == '6':
-                new_prm = int(input('Введите новое значение (0, 1 или 2): ').strip())
-                if new_prm in (0, 1, 2):
+                new_prm = int(input('Введите новое значение (0, 1, 2 или 3): ').strip())
+                if new_prm in (0, 1, 2, 3):
                     MODE = new_prm
 
             print()
@@ -112,14 +181,57 @@ def configure():
                 break
 
 
+@dataclass
+class FrameRef:
+    """Кадр в shared memory; path - файл в кэше, под которым он был бы сохранён."""
+    handle: dict
+    path: Path
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def stem(self):
+        return self.path.stem
+
+    @property
+    def suffix(self):
+        return self.path.suffix
+
+    def __str__(self):
+        return str(self.path)
+
+
+@dataclass(frozen=True)
+class CropRef:
+    """Область слайда для OCR: source - слайд (файл или FrameRef), box - (x1, y1, x2, y2), None - весь слайд."""
+    source: object
+    id: int
+    cls: int
+    box: tuple = None
+    route: str = "ocr_printed"
+
+    @property
+    def name(self):
+        return f"{self.id}_{self.cls}"
+
+    def __str__(self):
+        return f"{self.source}#{self.name}"
+
+
 @dataclass
 class Cache:
     root: Path
     img_exts: set
 
-    def __init__(self, root="cache", img_exts=None):
+    def __init__(self, root="cache", img_exts=None, store_root=None):
         self.root = Path(root)
         self.img_exts = img_exts
+        self.store_root = Path(store_root) if store_root else None
+        self._frames = {}
+        self._frames_lock = threading.Lock()
+        self._keys = {}
 
 
     def ensure_root(self):
@@ -151,13 +263,228 @@ class Cache:
         files = [x for x in p.iterdir() if x.is_file() and x.suffix.lower() in self.img_exts]
         return sorted(files)
 
+    def add_frame(self, dir_path, ref):
+        with self._frames_lock:
+            self._frames.setdefault(Path(dir_path), []).append(ref)
+
+    def list_frames(self, dir_path):
+        with self._frames_lock:
+            return sorted(self._frames.get(Path(dir_path), []), key=lambda r: r.name)
+
+    def list_sources(self, dir_path):
+        """Кадры директории: из shared memory и файлы, для которых нет кадра в памяти."""
+        frames = self.list_frames(dir_path)
+        names = {r.name for r in frames}
+        files = [p for p in self.list_images(dir_path) if p.name not in names]
+        return sorted(frames + files, key=lambda x: x.name)
+
+    def release_frames(self, dir_path=None):
+        """Освобождает shared memory кадров директории (вместе с вложенными) либо всех кадров."""
+        with self._frames_lock:
+            if dir_path is None:
+                keys = list(self._frames)
+            else:
+                d = Path(dir_path)
+                keys = [k for k in self._frames if k == d or d in k.parents]
+            refs = [r for k in keys for r in self._frames.pop(k)]
+
+        released = set()
+        for r in refs:
+            name = r.handle["shm"]
+            if name in released:
+                continue
+            released.add(name)
+            try:
+                release_frame(r.handle)
+            except Exception as e:
+                print(f"[warn] failed to release frame {r.path}: {e}")
+
+    # -------------------------
+    # Постоянный кэш результатов стадий: store_root/<stage>/<key[:2]>/<key>/
+    # -------------------------
+
+    @staticmethod
+    def hash_file(path, chunk_size=1 << 20):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def make_key(*parts):
+        h = hashlib.sha256()
+        h.update(json.dumps([STAGE_CACHE_VERSION, *parts], default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def set_key(self, dir_path, stage, key):
+        self._keys[(Path(dir_path), stage)] = key
+
+    def get_key(self, dir_path, stage):
+        return self._keys.get((Path(dir_path), stage))
+
+    def _store_dir(self, stage, key):
+        return self.store_root / stage / key[:2] / key
+
+    def store_get(self, stage, key):
+        if self.store_root is None or key is None:
+            return None
+        d = self._store_dir(stage, key)
+        meta_path = d / "meta.json"
+        if not meta_path.is_file():
+            return None
+        return d, json.loads(meta_path.read_text(encoding="utf-8"))
+
+    def store_put(self, stage, key, meta, files=None):
+        """
+        files: {имя в кэше: путь к файлу либо функция записи f(путь)}.
+        Запись атомарна: сначала во временную директорию.
+        """
+        if self.store_root is None or key is None:
+            return
+        d = self._store_dir(stage, key)
+        if d.exists():
+            return
+        tmp = d.with_name(f"{d.name}.tmp{os.getpid()}_{threading.get_ident()}")
+        tmp.mkdir(parents=True, exist_ok=True)
+        try:
+            for name, src in (files or {}).items():
+                if callable(src):
+                    src(tmp / name)
+                else:
+                    shutil.copy2(src, tmp / name)
+            (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, d)
+        except OSError as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not d.exists():
+                print(f"[warn] failed to store {stage}/{key}: {e}")
+
+    def store_drop(self, stage, key):
+        if self.store_root is None or key is None:
+            return
+        shutil.rmtree(self._store_dir(stage, key), ignore_errors=True)
+
+
+def host_models_spec(worker_script):
+    # модели стадий MODEL_HOST_MODELS загружает только model_host_worker.py
+    if worker_script != WORKER_SCRIPTS.get("model_host"):
+        return ""
+    return ",".join(f"{name}={WORKER_SCRIPTS[name]}" for name in MODEL_HOST_MODELS)
+
+
+def worker_settings(worker_script, threads=1):
+    """
+    Настройки воркера через окружение (все из worker_base.SETTINGS_ENV_DEFAULTS);
+    сервер моделей (worker_daemon.py) запускается с теми же.
+    """
+    return dict(
+        CONSPECT_TRACE="1" if tracing.enabled() else "0",
+        CONSPECT_BACKEND=INFERENCE_BACKEND,
+        CONSPECT_ORT_INTRA_THREADS=str(ONNX_INTRA_OP_THREADS),
+        CONSPECT_ORT_INTER_THREADS=str(ONNX_INTER_OP_THREADS),
+        CONSPECT_TESSERACT_ENGINE=TESSERACT_ENGINE,
+        # fp32 - точность по умолчанию, в окружение идут только остальные
+        CONSPECT_MODEL_PRECISION=",".join(f"{k}={v}" for k, v in MODEL_PRECISION.items() if v != "fp32"),
+        CONSPECT_WORKER_THREADS=str(threads),
+        CONSPECT_HOST_MODELS=host_models_spec(worker_script),
+    )
+
+
+def settings_mismatch(settings, worker_script, threads=1):
+    """{переменная: (у сервера, нужно)} для настроек, с которыми сервер моделей запущен иначе."""
+    want = worker_settings(worker_script, threads)
+    return {k: (settings.get(k, ""), v) for k, v in want.items() if settings.get(k, "") != v}
+
 
 class WorkerProcess:
-    def __init__(self, worker_script):
+    """
+    Обёртка над воркером: subprocess либо подключение к worker_daemon.py
+    по Unix-сокету (если задан socket_dir и сервер запущен).
+    Держит до window запросов в полёте: ответы сопоставляются по id
+    в отдельном потоке чтения, поэтому могут приходить в любом порядке.
+    """
+
+    def __init__(self, worker_script, window=1, threads=1, socket_dir=None):
         self.worker_script = worker_script
+        self.window = max(1, int(window))
+        self.threads = max(1, int(threads))
+        self.socket_path = socket_path(worker_script, socket_dir) if socket_dir else None
         self.proc = None
+        self._sock = None
+        self._rfile = None
+        self._wfile = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._slots = threading.Semaphore(self.window)
+        self._reader = None
+        self._closed = None
+        self._launch_t = None
+        self.startup = None
+
+    @property
+    def launched(self):
+        return self._rfile is not None
+
+    @property
+    def alive(self):
+        return self._reader is not None and self._closed is None
+
+    def launch(self):
+        """Запуск процесса (или подключение к серверу) без ожидания загрузки моделей."""
+        self._launch_t = time.perf_counter()
+        if not (self.socket_path is not None and self._connect()):
+            self._spawn()
+
+    def wait_started(self):
+        evt = self.read_event()
+        self.print_event(evt)
+        if not (evt.get("type") == "started" and evt.get("ok") is True):
+            raise RuntimeError(f"worker didn't start properly: {evt}")
+
+        if self._sock is not None:
+            # модели сервера загружены с его окружением, а не с настройками core.py
+            diff = settings_mismatch((evt.get("payload") or {}).get("settings") or {}, self.worker_script, self.threads)
+            if diff:
+                print(f"[warn] worker daemon {self.socket_path} runs with other settings: "
+                      + ", ".join(f"{k}={got!r} (need {want!r})" for k, (got, want) in diff.items())
+                      + "; starting a separate worker")
+                self._close()
+                self._launch_t = time.perf_counter()
+                self._spawn()
+                return self.wait_started()
+
+        pid = (evt.get("payload") or {}).get("pid")
+        if pid is not None:
+            tracing.process_name(pid, f"{self.worker_script} [{pid}]")
+
+        timing = dict((evt.get("payload") or {}).get("timing") or {})
+        if timing.get("total_s") is None:
+            # подключение к серверу моделей: модели уже загружены
+            timing["total_s"] = round(time.perf_counter() - self._launch_t, 3)
+        self.startup = timing
+        print(f"[startup] {self.worker_script}: " + ", ".join(f"{k}={v}" for k, v in self.startup.items()))
+
+        self._closed = None
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        return evt
 
     def start(self):
+        if not self.launched:
+            self.launch()
+        return self.wait_started()
+
+    def _spawn(self):
+        env = dict(
+            os.environ,
+            CONSPECT_LAUNCH_TS=str(time.time()),
+            **worker_settings(self.worker_script, self.threads),
+        )
         self.proc = subprocess.Popen(
             [sys.executable, self.worker_script],
             stdin=subprocess.PIPE,
@@ -165,29 +492,73 @@ class WorkerProcess:
             stderr=subprocess.STDOUT,
             text=True,
             bufsize=1,
+            env=env,
         )
-        evt = self.read_event()
-        print("EVENT:", evt)
-        if not (evt.get("type") == "started" and evt.get("ok") is True):
-            raise RuntimeError(f"worker didn't start properly: {evt}")
-        return evt
+        self._rfile, self._wfile = self.proc.stdout, self.proc.stdin
+
+    def _connect(self):
+        if not self.socket_path.exists():
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError as e:
+            print(f"[warn] worker daemon {self.socket_path} is not available: {e}")
+            sock.close()
+            return False
+        self._sock = sock
+        self._rfile = sock.makefile("r", encoding="utf-8")
+        self._wfile = sock.makefile("w", encoding="utf-8")
+        return True
 
     def stop(self, req_id):
-        self.send({"id": req_id, "op": "ext"})
-        evt = self.read_event()
-        print("EVENT:", evt)
-        rc = self.proc.wait(timeout=10)
-        print(f"worker exit code: {rc}\n")
-        self.proc = None
+        evt = self.request(req_id, "ext", None)
+        rc = None
+        if self.proc is not None:
+            rc = self.proc.wait(timeout=10)
+            print(f"worker exit code: {rc}\n")
+        self._reader.join(timeout=10)
+        self._close()
         return evt, rc
 
+    def kill(self):
+        if self.proc is not None:
+            try:
+                self.proc.kill()
+                self.proc.wait(timeout=10)
+            except Exception as e:
+                print(f"[warn] failed to kill worker {self.worker_script}: {e}")
+        self._close()
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            for f in (self._rfile, self._wfile):
+                try:
+                    f.close()
+                except OSError:
+                    pass
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._rfile = None
+        self._wfile = None
+        self._reader = None
+        self.proc = None
+
     def send(self, obj):
-        self.proc.stdin.write(json.dumps(obj, ensure_ascii=False, default=str) + "\n")
-        self.proc.stdin.flush()
+        with self._send_lock:
+            self._wfile.write(json.dumps(obj, ensure_ascii=False, default=str) + "\n")
+            self._wfile.flush()
 
     def read_event(self):
         while True:
-            line = self.proc.stdout.readline()
+            line = self._rfile.readline()
             if line == "":
                 raise RuntimeError("worker stdout closed")
             line = line.strip()
@@ -198,24 +569,54 @@ class WorkerProcess:
             except json.JSONDecodeError:
                 print("[bad json]", line)
 
-    def wait_result(self, req_id):
-        while True:
-            evt = self.read_event()
-            print("EVENT:", evt)
-
-            if evt.get("type") != "result":
-                continue
-            if evt.get("id") != req_id:
-                continue
-            return evt
+    def _read_loop(self):
+        try:
+            while True:
+                evt = self.read_event()
+
+                fut = None
+                if evt.get("type") == "result":
+                    with self._lock:
+                        fut = self._pending.pop(evt.get("id"), None)
+                if fut is None:
+                    self.print_event(evt)
+                    continue
+                fut.set_result(evt)
+        except Exception as e:
+            with self._lock:
+                self._closed = e
+                pending, self._pending = self._pending, {}
+            for fut in pending.values():
+                fut.set_exception(e)
+
+    def submit(self, req_id, op, payload):
+        """Отправляет запрос, не дожидаясь ответа. Возвращает Future с result-событием."""
+        self._slots.acquire()
+        fut = Future()
+        fut.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            if self._closed is not None:
+                fut.set_exception(RuntimeError(f"worker is closed: {self._closed}"))
+                return fut
+            self._pending[req_id] = fut
+        try:
+            self.send({"id": req_id, "op": op, "payload": payload})
+        except OSError as e:
+            with self._lock:
+                self._pending.pop(req_id, None)
+            fut.set_exception(e)
+        return fut
 
     def request(self, req_id, op, payload):
-        self.send({"id": req_id, "op": op, "payload": payload})
-        return self.wait_result(req_id)
+        return self.submit(req_id, op, payload).result()
 
     def print_event(self, evt, truncate_payload_keys=None, max_len=30):
-        e = copy.deepcopy(evt)
-        if truncate_payload_keys and isinstance(e.get("payload"), dict):
+        if not PRINT_EVENTS:
+            return
+        e = evt
+        if truncate_payload_keys and isinstance(evt.get("payload"), dict):
+            # копируем только верхние уровни, которые меняем
+            e = {**evt, "payload": dict(evt["payload"])}
             for k in truncate_payload_keys:
                 v = e["payload"].get(k)
                 if isinstance(v, str) and len(v) > max_len:
@@ -223,6 +624,151 @@ class WorkerProcess:
         print("EVENT:", e)
 
 
+class WorkerPool:
+    """
+    Пул из size воркеров одной стадии.
+    Запрос уходит первому воркеру со свободным местом в окне (window запросов
+    на воркер); упавший воркер выводится из пула, остальные продолжают работу.
+    """
+
+    def __init__(self, worker_script, size=1, window=1, threads=1, socket_dir=None, name=None, metrics=None):
+        self.worker_script = worker_script
+        self.name = name or worker_script
+        self.metrics = metrics
+        self.size = max(1, int(size))
+        self.window = max(1, int(window))
+        self.workers = [
+            WorkerProcess(worker_script, window=self.window, threads=threads, socket_dir=socket_dir)
+            for _ in range(self.size)
+        ]
+        self._idle = queue.Queue()
+        self._alive = 0
+        self._dead = set()
+        self._lock = threading.Lock()
+        # пул может быть общим для нескольких стадий (model_host_worker.py)
+        self.users = []
+        self.req_ids = itertools.count(1)  # id сообщений уникальны в пределах процесса воркера
+        self._start_lock = threading.Lock()
+        self._started = None
+        self._stops = 0
+
+    @property
+    def capacity(self):
+        return self.size * self.window
+
+    def attach(self, stage_name):
+        self.users.append(stage_name)
+
+    def _metric_names(self):
+        return self.users or [self.name]
+
+    def launch(self):
+        for w in self.workers:
+            if not w.launched:
+                w.launch()
+
+    def start(self):
+        with self._start_lock:
+            if self._started is not None:
+                return self._started
+
+            # все воркеры пула загружают модели одновременно
+            for w in self.workers:
+                if not w.launched:
+                    w.launch()
+
+            events = []
+            for w in self.workers:
+                events.append(w.wait_started())
+                if self.metrics is not None:
+                    for name in self._metric_names():
+                        self.metrics.add_startup(name, w.startup)
+                self._alive += 1
+                for _ in range(self.window):
+                    self._idle.put(w)
+            self._started = events
+            return events
+
+    def stop(self, req_id):
+        with self._start_lock:
+            # общий пул останавливает последняя стадия
+            self._stops += 1
+            if self._stops < len(self.users):
+                return []
+
+        out = []
+        for w in self.workers:
+            if w.alive:
+                evt, rc = w.stop(req_id)
+                out.append((evt, rc))
+                bye = evt.get("payload") or {}
+                if self.metrics is not None and evt.get("ok") and bye.get("pid") is not None:
+                    for name in self._metric_names():
+                        self.metrics.add_rss(name, bye["pid"], bye.get("peak_rss_mb"))
+            else:
+                w.kill()
+        return out
+
+    def _acquire(self):
+        while True:
+            w = self._idle.get()
+            if w is None:
+                # все воркеры упали: будим остальных ожидающих
+                self._idle.put(None)
+                raise RuntimeError(f"all workers died: {self.worker_script}")
+            if w in self._dead:
+                continue
+            return w
+
+    def _retire(self, w, err):
+        with self._lock:
+            if w in self._dead:
+                return
+            self._dead.add(w)
+            self._alive -= 1
+            if self._alive == 0:
+                self._idle.put(None)
+        print(f"[error] worker {self.worker_script} crashed: {err}")
+        w.kill()
+
+    def submit(self, req_id, op, payload, name=None):
+        """name - стадия для метрик и трассы (у общего пула их несколько)."""
+        name = name or self.name
+        ts_submit = tracing.now_us()
+        t_submit = time.perf_counter()
+        w = self._acquire()
+        t_sent = time.perf_counter()
+        out = Future()
+
+        def _done(fut):
+            err = fut.exception()
+            if err is None:
+                self._idle.put(w)
+                evt = fut.result()
+                worker_trace = evt.pop("trace", None)
+                if tracing.enabled():
+                    if worker_trace:
+                        tracing.extend(worker_trace)
+                    queue_us = int((t_sent - t_submit) * 1e6)
+                    tracing.async_span(f"{name} {op}", f"{name}:{req_id}", ts_submit,
+                                       tracing.now_us() - ts_submit, cat=name, queue_us=queue_us)
+                if self.metrics is not None:
+                    self.metrics.add_request(name, evt, t_submit, t_sent, time.perf_counter())
+                out.set_result(evt)
+            else:
+                self._retire(w, err)
+                out.set_result({"type": "result", "id": req_id, "ok": False, "error": f"worker crashed: {err}"})
+
+        w.submit(req_id, op, payload).add_done_callback(_done)
+        return out
+
+    def request(self, req_id, op, payload, name=None):
+        return self.submit(req_id, op, payload, name).result()
+
+    def print_event(self, evt, truncate_payload_keys=None, max_len=30):
+        self.workers[0].print_event(evt, truncate_payload_keys, max_len)
+
+
 class ResultWriter:
     def __init__(self, result_dir="", filename="result.txt", mode=2):
         self.mode = mode
@@ -256,6 +802,12 @@ class ResultWriter:
         if e_text:
             self._e_buf.append(e_text)
 
+    def add_duplicate(self, kept_title):
+        # ранний снимок серии: текст слайда - в блоке последнего снимка
+        note = f"(тот же слайд, текст - в блоке {kept_title})"
+        self._t_buf.append(note)
+        self._e_buf.append(note)
+
     def flush_image_block(self):
         if self.mode == 2:
             self.f.write("{{tesseract}}\n\n")
@@ -266,7 +818,7 @@ class ResultWriter:
             self.f.write("{{easyocr}}\n\n")
             self.f.write("\n\n".join(self._e_buf).strip() + "\n\n")
 
-        elif self.mode == 0:
+        elif self.mode in (0, 3):
             self.f.write("\n\n".join(self._t_buf).strip() + "\n\n")
 
         elif self.mode == 1:
@@ -275,10 +827,152 @@ class ResultWriter:
         self.f.flush()
 
     def end(self):
+        if not self.f:
+            return
         self.f.write("=" * 100 + "\n")
         self.f.flush()
 
 
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, math.ceil(q / 100 * len(values)) - 1)
+    return values[k]
+
+
+def _round(v, nd=2):
+    return None if v is None else round(v, nd)
+
+
+class Metrics:
+    """
+    Замеры по запросам к воркерам и итоговый отчёт.
+    На каждый запрос: queue (ожидание свободного воркера), ipc (канал + JSON,
+    round trip минус время воркера), compute (время обработки в воркере), total.
+    """
+
+    LATENCY_KEYS = ("queue", "ipc", "compute", "total")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self.stages = {}
+        self.notes = {}
+        self.inputs = 0
+
+    def register(self, name):
+        with self._lock:
+            self._stage(name)
+
+    def _stage(self, name):
+        st = self.stages.get(name)
+        if st is None:
+            st = self.stages[name] = {
+                "images": 0, "errors": 0, "cached": 0, "requests": 0,
+                "first": None, "last": None, "startup": [], "rss": {}, "counts": {},
+                "latency": {k: [] for k in self.LATENCY_KEYS},
+            }
+        return st
+
+    def add_startup(self, stage, startup):
+        with self._lock:
+            self._stage(stage)["startup"].append(startup)
+
+    def count(self, stage, key, n=1):
+        """Счётчик событий стадии (например, escalated); в отчёте - число и доля от изображений стадии."""
+        with self._lock:
+            counts = self._stage(stage)["counts"]
+            counts[key] = counts.get(key, 0) + n
+
+    def note(self, section, key, n=1):
+        """Счётчик вне стадий воркеров (например, dedup); в отчёте - отдельный раздел верхнего уровня."""
+        with self._lock:
+            counts = self.notes.setdefault(section, {})
+            counts[key] = counts.get(key, 0) + n
+
+    def add_rss(self, stage, pid, mb):
+        """Пиковый RSS процесса-воркера (из ответа на ext); процесс учитывается по pid один раз."""
+        with self._lock:
+            self._stage(stage)["rss"][pid] = mb
+
+    def add_request(self, stage, evt, t_submit, t_sent, t_done):
+        timing = evt.get("timing") or {}
+        compute_ms = timing.get("compute_ms")
+        # ожидание блокировки модели внутри воркера (общий процесс, сервер моделей) - тоже очередь
+        wait_ms = timing.get("wait_ms") or 0.0
+        rtt_ms = (t_done - t_sent) * 1000
+        with self._lock:
+            st = self._stage(stage)
+            st["requests"] += 1
+            st["first"] = t_submit if st["first"] is None else min(st["first"], t_submit)
+            lat = st["latency"]
+            lat["queue"].append((t_sent - t_submit) * 1000 + wait_ms)
+            lat["total"].append((t_done - t_submit) * 1000)
+            if compute_ms is not None:
+                lat["compute"].append(compute_ms)
+                lat["ipc"].append(max(0.0, rtt_ms - compute_ms - wait_ms))
+
+    def add_image(self, stage, ok, cached=False):
+        now = time.perf_counter()
+        with self._lock:
+            st = self._stage(stage)
+            st["images"] += 1
+            st["errors"] += 0 if ok else 1
+            st["cached"] += 1 if cached else 0
+            st["first"] = now if st["first"] is None else min(st["first"], now)
+            st["last"] = now
+
+    def summary(self):
+        wall_s = time.perf_counter() - self._t0
+        out = {
+            "wall_s": round(wall_s, 3),
+            "inputs": self.inputs,
+            "images_per_s": round(self.inputs / wall_s, 3) if wall_s > 0 else None,
+            "stages": {},
+        }
+        workers_rss = {}
+        with self._lock:
+            for name, st in self.stages.items():
+                workers_rss.update(st["rss"])
+                # от первого запроса стадии до последнего результата
+                active_s = (st["last"] - st["first"]) if st["last"] is not None else 0
+                out["stages"][name] = {
+                    "images": st["images"],
+                    "errors": st["errors"],
+                    "cached": st["cached"],
+                    "requests": st["requests"],
+                    "counts": {
+                        k: {"n": n, "rate": round(n / st["images"], 4) if st["images"] else None}
+                        for k, n in st["counts"].items()
+                    },
+                    "images_per_s": round(st["images"] / active_s, 3) if active_s > 0 else None,
+                    "latency_ms": {
+                        k: {f"p{q}": _round(percentile(v, q)) for q in (50, 95, 99)}
+                        for k, v in st["latency"].items()
+                    },
+                    "startup": st["startup"],
+                    "peak_rss_mb": _round(sum(v for v in st["rss"].values() if v), 1) if st["rss"] else None,
+                }
+            for section, counts in self.notes.items():
+                out[section] = dict(counts)
+        orchestrator_mb = peak_rss_mb()
+        workers_mb = sum(v for v in workers_rss.values() if v)
+        out["peak_rss_mb"] = {
+            "orchestrator": orchestrator_mb,
+            "workers": _round(workers_mb, 1),
+            "processes": len(workers_rss) + 1,
+            # сумма пиков по процессам - оценка сверху для одновременного потребления
+            "total": _round(workers_mb + (orchestrator_mb or 0), 1),
+        }
+        return out
+
+    def write(self, path):
+        data = self.summary()
+        Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        return data
+
+
 def handle_error_whiteboard(img_path, img_cache_dir):
     if WHEN_ERRORS_IN_WHITEBOARD_DELETE_DIR:
         try:
@@ -293,77 +987,324 @@ def handle_error_whiteboard(img_path, img_cache_dir):
             print(f"[warn] failed to save failed input {img_path} -> {dst}: {e}")
 
 
-def handle_error_classcutter(prev_stage_img_path, class_cutter_dir):
+SLIDE_HASH_FILENAME = "slide_hash.txt"
+DUPLICATE_FILENAME = "duplicate_of.txt"
+
+
+def save_slide_hash(item_dir, slide_hash):
+    (Path(item_dir) / SLIDE_HASH_FILENAME).write_text(slide_hash, encoding="utf-8")
+
+
+def load_slide_hash(item_dir):
+    path = Path(item_dir) / SLIDE_HASH_FILENAME
+    if not path.is_file():
+        return None
+    return path.read_text(encoding="utf-8").strip()
+
+
+def hash_distance(a, b):
+    """Число различающихся бит двух хэшей слайдов (hex)."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def duplicate_of(item_dir):
+    """Имя изображения (последний снимок серии), повтором которого помечен слайд (SlideDedupStage), иначе None."""
+    path = Path(item_dir) / DUPLICATE_FILENAME
+    if not path.is_file():
+        return None
+    return path.read_text(encoding="utf-8").strip()
+
+
+BOXES_FILENAME = "boxes.json"
+ROUTES = ("ocr_printed", "ocr_handwritten", "figure", "drop")
+OCR_ROUTES = ("ocr_printed", "ocr_handwritten")
+
+
+def class_routes():
+    """CLASS_ROUTES с проверкой; классы, которых нет в таблице, отбрасываются."""
+    routes = {int(cls): route for cls, route in CLASS_ROUTES.items()}
+    for cls, route in routes.items():
+        if route not in ROUTES:
+            raise ValueError(f"unknown route for class {cls}: {route}")
+    return routes
+
+
+def classes_for(*routes):
+    return sorted(cls for cls, route in class_routes().items() if route in routes)
+
+
+def save_boxes(class_cutter_dir, boxes):
+    """Упорядоченные рамки и классы слайда от class cutter: [{"id", "cls", "box": [x1, y1, x2, y2] | None}]."""
+    path = Path(class_cutter_dir) / BOXES_FILENAME
+    path.write_text(json.dumps(boxes), encoding="utf-8")
+    return path
+
+
+def load_boxes(class_cutter_dir):
+    path = Path(class_cutter_dir) / BOXES_FILENAME
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def handle_error_classcutter(class_cutter_dir):
     if WHEN_ERRORS_IN_CLASSCUTTER_IGNORE_DIR:
         return
-    else:
-        dst = class_cutter_dir / f"FAILED_{Path(prev_stage_img_path).name}"
-        try:
-            shutil.copy2(prev_stage_img_path, dst)
-        except Exception as e:
-            print(f"[warn] failed to save failed input {prev_stage_img_path} -> {dst}: {e}")
+    # весь слайд - один кроп печатного текста
+    save_boxes(class_cutter_dir, [{"id": 0, "cls": 0, "box": None, "route": "ocr_printed"}])
+
+
+_weights_digests = {}
+
+
+def weights_digest(name):
+    if name not in _weights_digests:
+        weights = HERE.parent / 'weights' / name / 'best.pt'
+        _weights_digests[name] = Cache.hash_file(weights) if weights.exists() else None
+    return _weights_digests[name]
+
+
+def image_payload(img_path):
+    if isinstance(img_path, FrameRef):
+        return {"image_path": str(img_path.path), "image": img_path.handle}
+    return {"image_path": str(img_path)}
+
+
+def transport_payload():
+    # постоянный кэш пишет кадры shm сам (WhiteboardStage.store_cached), без файла от воркера
+    return {"transport": IMAGE_TRANSPORT, "save": SAVE_INTERMEDIATE_IMAGES}
 
 
 class Stage:
     """
     Шаблон стадии:
-      init -> старт воркера -> start_hook()
+      launch -> запуск воркеров без ожидания загрузки (можно заранее, для всех стадий сразу)
+      init -> ожидание started от пула воркеров -> start_hook()
       iter_one(items):
+          - группируем items по batch_size и вызываем process_items(group),
+            при workers > 1 - параллельно на нескольких воркерах
+          - результаты передаём в commit_item строго в порядке items
+      process_items(items):
           - на каждый item создаём директорию в кэше
           - получаем список изображений (hook get_images_list)
-          - для каждого изображения собираем payload (hook make_payload)
-          - отправляем воркеру, ждём result
-          - решаем ok/не ok (hook is_worker_ok)
+          - для каждого изображения считаем ключ (hook cache_key) и при попадании
+            в постоянный кэш берём результат оттуда (hook load_cached)
+          - для остальных собираем payload (hook make_payload)
+          - отправляем все запросы свободным воркерам (do, либо do_batch
+            по batch_size изображений), затем собираем result
+          - успешные результаты сохраняем в постоянный кэш (hook store_cached)
+      commit_item(item, item_dir, results):
+          - решаем ok/не ok
           - on_success / on_error
+          - возвращаем элемент для следующей стадии (hook item_result)
       end():
           - save_result() (hook)
-          - отправляем ext воркеру и ждём bye
+          - отправляем ext воркерам и ждём bye
     """
 
-    def __init__(self, name, worker_script, cache):
+    batch_per_item = False  # True - изображения одного item уходят одним do_batch
+
+    def __init__(self, name, worker_script, cache, workers=1, window=1, threads=1, batch_size=1, socket_dir=None,
+                 metrics=None, pool=None):
         self.name = name
         self.worker_script = worker_script
         self.cache = cache
-
-        self.worker = WorkerProcess(worker_script)
-        self.req_id = 1  # счётчик сообщений воркеру
+        self.batch_size = max(1, int(batch_size))
+
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.register(name)
+        # pool - общий пул model_host_worker.py: запросы несут ключ модели (имя стадии)
+        self.hosted = pool is not None
+        self.pool = pool or WorkerPool(
+            worker_script, size=workers, window=window, threads=threads, socket_dir=socket_dir,
+            name=name, metrics=metrics,
+        )
+        self.pool.attach(name)
+        self.started = []  # payload событий started
 
     def run(self, items):
         print(f"\n--- STAGE: {self.name} ---")
         self.init()
-        self.iter_one(items)
+        out = self.iter_one(items)
         self.end()
         print(f"--- STAGE DONE: {self.name} ---\n")
+        return out
+
+    def launch(self):
+        self.pool.launch()
 
     def init(self):
-        self.worker.start()
+        self.started = [evt.get("payload") or {} for evt in self.pool.start()]
         self.start_hook()
 
+    def next_req_id(self):
+        return next(self.pool.req_ids)
+
+    def worker_info(self, key):
+        """Поле из started первого воркера (например, выбранный бэкенд модели)."""
+        if not self.started:
+            return None
+        started = self.started[0]
+        if self.hosted:
+            started = (started.get("models") or {}).get(self.name) or {}
+        return started.get(key)
+
     def iter_one(self, items):
+        return list(self.iter_items(items))
+
+    def iter_items(self, items):
+        for chunk in self._map_ordered(self.process_items, self._chunks(items)):
+            for item, item_dir, results in chunk:
+                with tracing.span(f"{self.name}.commit", cat="orchestrator"):
+                    out = self.commit_item(item, item_dir, results)
+                if out is not None:
+                    yield out
+
+    def _chunks(self, items):
+        buf = []
+        for item in items:
+            buf.append(item)
+            if len(buf) >= self.batch_size:
+                yield buf
+                buf = []
+        if buf:
+            yield buf
+
+    def _map_ordered(self, fn, items):
+        n = self.pool.capacity
+        if n == 1:
+            for item in items:
+                yield fn(item)
+            return
+
+        # вход читается в отдельном потоке: готовый результат из головы очереди отдаётся сразу,
+        # не дожидаясь следующих входных элементов; в работе не больше n элементов,
+        # чтобы не вычерпывать очередь потокового режима
+        slots = threading.Semaphore(n)
+        futures = queue.Queue()
+        stop = threading.Event()
+        end = object()
+
+        with ThreadPoolExecutor(max_workers=n) as ex:
+            def feed():
+                try:
+                    for item in items:
+                        if not stop.is_set():
+                            slots.acquire()
+                        # после остановки вход только разгружается, чтобы не заблокировать предыдущую стадию
+                        if not stop.is_set():
+                            futures.put(ex.submit(fn, item))
+                except Exception as e:
+                    failed = Future()
+                    failed.set_exception(e)
+                    futures.put(failed)
+                finally:
+                    futures.put(end)
+
+            feeder = threading.Thread(target=feed, name=f"{self.name}:feed", daemon=True)
+            feeder.start()
+            try:
+                while True:
+                    fut = futures.get()
+                    if fut is end:
+                        return
+                    out = fut.result()
+                    slots.release()
+                    yield out
+            finally:
+                stop.set()
+                slots.release()
+                feeder.join()
+
+    def process_items(self, items):
+        with tracing.span(f"{self.name}.process", cat="orchestrator", items=len(items)):
+            return self._process_items(items)
+
+    def _process_items(self, items):
+        jobs = []
+        tasks = []
         for item in items:
             item_dir = self.make_item_dir(item)
-
             images = self.get_images_list(item, item_dir)
+            results = [None] * len(images)
+            jobs.append((item, item_dir, results))
+
+            for i, img_path in enumerate(images):
+                key = self.cache_key(item, item_dir, img_path)
+                entry = self.cache.store_get(self.name, key)
+                if entry is not None and not self.cache_usable(entry[1]):
+                    # запись старого формата - пересчитываем
+                    self.cache.store_drop(self.name, key)
+                    entry = None
+                if entry is not None:
+                    evt = self.load_cached(item, item_dir, img_path, *entry)
+                    self._done(item_dir, img_path, key, evt, results, i)
+                    continue
 
-            for img_path in images:
                 payload = self.make_payload(item, item_dir, img_path)
+                if self.hosted:
+                    payload = {**payload, "model": self.name}
+                tasks.append((item_dir, img_path, key, payload, results, i))
+
+        groups = None
+        if self.batch_per_item:
+            groups = [n for n in (sum(1 for t in tasks if t[4] is job[2]) for job in jobs) if n]
+        events = self._request_all([t[3] for t in tasks], groups)
+        for (item_dir, img_path, key, _, results, i), evt in zip(tasks, events):
+            if evt.get("ok") and key is not None:
+                self.store_cached(key, item_dir, img_path, evt)
+            self._done(item_dir, img_path, key, evt, results, i)
+
+        return jobs
+
+    def _done(self, item_dir, img_path, key, evt, results, i):
+        self.print_event(evt)
+        results[i] = (img_path, evt)
+        if self.metrics is not None:
+            self.metrics.add_image(self.name, evt.get("ok"), cached=(evt.get("payload") or {}).get("cached", False))
+        if evt.get("ok") and key is not None:
+            self.cache.set_key(item_dir, self.name, key)
+
+    def _request_all(self, payloads, groups=None):
+        """groups - размеры подряд идущих групп для do_batch; по умолчанию - по batch_size."""
+        if groups is None:
+            if self.batch_size == 1:
+                futures = [self.pool.submit(self.next_req_id(), "do", p, self.name) for p in payloads]
+                return [fut.result() for fut in futures]
+            groups = [min(self.batch_size, len(payloads) - i) for i in range(0, len(payloads), self.batch_size)]
+
+        futures = []
+        start = 0
+        for n in groups:
+            group = payloads[start:start + n]
+            start += n
+            req_id = self.next_req_id()
+            futures.append((req_id, len(group), self.pool.submit(req_id, "do_batch", {"items": group}, self.name)))
+
+        events = []
+        for req_id, n, fut in futures:
+            evt = fut.result()
+            if not evt.get("ok"):
+                events.extend({"type": "result", "id": req_id, "ok": False, "error": evt.get("error")} for _ in range(n))
+                continue
+            for r in evt["payload"]["items"]:
+                events.append({"type": "result", "id": req_id, **r})
+        return events
 
-                evt = self.worker.request(self.req_id, "do", payload)
-
-                self.print_event(evt)
-
-                if evt.get("ok"):
-                    self.on_success(item, item_dir, img_path, evt)
-                else:
-                    self.on_error(item, item_dir, img_path, evt)
+    def commit_item(self, item, item_dir, results):
+        for img_path, evt in results:
+            if evt.get("ok"):
+                self.on_success(item, item_dir, img_path, evt)
+            else:
+                self.on_error(item, item_dir, img_path, evt)
 
-                self.req_id += 1
+        return self.item_result(item, item_dir)
 
     def end(self):
         self.save_result()
 
-        self.worker.stop(self.req_id)
-        self.req_id += 1
+        self.pool.stop(self.next_req_id())
 
     # -------------------------
     # Переопределяются в конкретной стадии
@@ -388,62 +1329,175 @@ class Stage:
     def on_error(self, item, item_dir, img_path, evt):
         pass
 
+    def item_result(self, item, item_dir):
+        return item_dir
+
+    def cache_key(self, item, item_dir, img_path):
+        # None - результат стадии не кэшируется
+        return None
+
+    def cache_usable(self, meta):
+        return True
+
+    def load_cached(self, item, item_dir, img_path, entry_dir, meta):
+        return {"type": "result", "id": None, "ok": True, "payload": {**meta, "cached": True}}
+
+    def store_cached(self, key, item_dir, img_path, evt):
+        pass
+
     def save_result(self):
         pass
 
     def print_event(self, evt):
-        print("EVENT:", evt)
+        if PRINT_EVENTS:
+            print("EVENT:", evt)
 
 
 class WhiteboardStage(Stage):
-    def __init__(self, cache):
-        super().__init__(name="whiteboard", worker_script="whiteboard_worker.py", cache=cache)
+    def __init__(self, cache, **opts):
+        super().__init__(name="whiteboard", worker_script=WORKER_SCRIPTS["whiteboard"], cache=cache, **opts)
 
     def get_images_list(self, item, item_dir):
         return [Path(item)]
 
+    def out_path(self, item_dir, img_path):
+        return item_dir / f"whiteboard_{img_path.name}"
+
     def make_payload(self, item, item_dir, img_path):
-        out_img = item_dir / f"whiteboard_{img_path.name}"
         return {
             "image_path": str(img_path),
-            "out_path": str(out_img),
+            "out_path": str(self.out_path(item_dir, img_path)),
             "target_class": TARGET_CLASS,
             "target_strategy": TARGET_STRATEGY,
+            "decode_reduction": WHITEBOARD_DECODE_REDUCTION,
+            **transport_payload(),
         }
 
+    def on_success(self, item, item_dir, img_path, evt):
+        payload = evt.get("payload") or {}
+        warp = payload.get("warp")
+        if warp:
+            self.cache.add_frame(item_dir, FrameRef(warp, self.out_path(item_dir, img_path)))
+        if payload.get("slide_hash"):
+            save_slide_hash(item_dir, payload["slide_hash"])
+
+    def cache_key(self, item, item_dir, img_path):
+        if self.cache.store_root is None:
+            return None
+        # shm - кадр в кэше без потерь (PNG), file - тот же JPEG, что читают следующие стадии
+        return self.cache.make_key(
+            self.name, self.cache.hash_file(img_path),
+            TARGET_CLASS, TARGET_STRATEGY, WHITEBOARD_DECODE_REDUCTION, IMAGE_TRANSPORT,
+            weights_digest("whiteboard"), self.worker_info("backend"),
+        )
+
+    def cache_usable(self, meta):
+        # без хэша слайда SlideDedupStage не нашёл бы повтор
+        return "slide_hash" in meta
+
+    def load_cached(self, item, item_dir, img_path, entry_dir, meta):
+        payload = {"slide_hash": meta.get("slide_hash"), "cached": True}
+        if meta.get("frame"):
+            payload["warp"] = load_frame(entry_dir / meta["frame"])
+        else:
+            out = self.out_path(item_dir, img_path)
+            shutil.copy2(entry_dir / meta["warp"], out)
+            payload["warp_path"] = str(out)
+        return {"type": "result", "id": None, "ok": True, "payload": payload}
+
+    def store_cached(self, key, item_dir, img_path, evt):
+        payload = evt["payload"]
+        meta = {"slide_hash": payload.get("slide_hash")}
+        if payload.get("warp"):
+            meta["frame"] = "warp" + FRAME_FILE_EXT
+            files = {meta["frame"]: lambda dst: save_frame(payload["warp"], dst)}
+        elif payload.get("warp_path"):
+            meta["warp"] = "warp" + Path(payload["warp_path"]).suffix
+            files = {meta["warp"]: payload["warp_path"]}
+        else:
+            return
+        self.cache.store_put(self.name, key, meta, files)
+
     def on_error(self, item, item_dir, img_path, evt):
         handle_error_whiteboard(img_path, item_dir)
 
+    def item_result(self, item, item_dir):
+        # директория могла быть удалена в handle_error_whiteboard
+        if not item_dir.is_dir():
+            return None
+        return item_dir
+
 
 class ClassCutterStage(Stage):
-    def __init__(self, cache):
-        super().__init__(name="class_cutter", worker_script="class_cutter_worker.py", cache=cache)
+    def __init__(self, cache, figures_dir=None, **opts):
+        super().__init__(name="class_cutter", worker_script=WORKER_SCRIPTS["class_cutter"], cache=cache, **opts)
+        self.routes = class_routes()
+        self.figures_dir = Path(figures_dir) if figures_dir else Path(FIGURES_DIRNAME)
+
+    def start_hook(self):
+        if classes_for("figure"):
+            self.figures_dir.mkdir(parents=True, exist_ok=True)
 
     def make_item_dir(self, item):
         return Path(item)
 
     def get_images_list(self, item, item_dir):
-        imgs = self.cache.list_images(item_dir)
+        if duplicate_of(item_dir):
+            return []
+        imgs = self.cache.list_sources(item_dir)
         if not imgs:
             return []
         return [imgs[0]]
 
     def make_payload(self, item, item_dir, img_path):
-        out_dir = self.cache.make_dir(item_dir, "class_cutter")
+        # воркер возвращает только классы, у которых есть потребитель
         return {
-            "image_path": str(img_path),
-            "out_dir": str(out_dir),
+            **image_payload(img_path),
+            "classes": classes_for(*OCR_ROUTES, "figure"),
+            "figures": {
+                "classes": classes_for("figure"),
+                "dir": str(self.figures_dir),
+                "prefix": item_dir.name,
+            },
         }
 
-    def on_error(self, item, item_dir, img_path, evt):
+    def on_success(self, item, item_dir, img_path, evt):
         out_dir = self.cache.make_dir(item_dir, "class_cutter")
-        handle_error_classcutter(img_path, out_dir)
+        save_boxes(out_dir, (evt.get("payload") or {}).get("boxes", []))
+
+    def cache_key(self, item, item_dir, img_path):
+        # вход стадии однозначно определяется ключом предыдущей
+        prev_key = self.cache.get_key(item_dir, "whiteboard")
+        if prev_key is None:
+            return None
+        return self.cache.make_key(self.name, prev_key, weights_digest("class_cutter"), self.worker_info("backend"),
+                                   sorted(self.routes.items()))
+
+    def load_cached(self, item, item_dir, img_path, entry_dir, meta):
+        boxes = []
+        for box in meta["boxes"]:
+            if box.get("figure"):
+                dst = self.figures_dir / f"{item_dir.name}_{box['id']}_{box['cls']}.png"
+                shutil.copy2(entry_dir / Path(box["figure"]).name, dst)
+                box = {**box, "figure": str(dst)}
+            boxes.append(box)
+        return {"type": "result", "id": None, "ok": True, "payload": {"boxes": boxes, "cached": True}}
+
+    def store_cached(self, key, item_dir, img_path, evt):
+        boxes = evt["payload"].get("boxes", [])
+        files = {Path(b["figure"]).name: b["figure"] for b in boxes if b.get("figure")}
+        self.cache.store_put(self.name, key, {"boxes": boxes}, files)
+
+    def on_error(self, item, item_dir, img_path, evt):
+        handle_error_classcutter(self.cache.make_dir(item_dir, "class_cutter"))
 
 
 class OCRStage(Stage):
-    def __init__(self, cache, writer):
-        super().__init__(name="ocr", worker_script="baseOCR2_worker.py", cache=cache)
+    def __init__(self, cache, writer, **opts):
+        super().__init__(name="ocr", worker_script=WORKER_SCRIPTS["ocr"], cache=cache, **opts)
         self.writer = writer
+        self.routes = class_routes()
+        self.batch_per_item = OCR_BATCH_PER_SLIDE
 
     def start_hook(self):
         p = self.writer.open()
@@ -453,94 +1507,404 @@ class OCRStage(Stage):
         return Path(item)
 
     def get_images_list(self, item, item_dir):
-        class_cutter_dir = item_dir / "class_cutter"
-        if not class_cutter_dir.is_dir():
+        boxes = load_boxes(item_dir / "class_cutter")
+        if not boxes:
+            return []
+        slides = self.cache.list_sources(item_dir)
+        if not slides:
             return []
 
-        imgs = self.cache.list_images(class_cutter_dir)
-
-        def _key(p: Path):
-            stem = p.stem
-            if "FAILED" in stem:
-                return (10**9, stem)
-            try:
-                n = int(stem.split("_")[0])
-            except Exception:
-                n = 10**9
-            return (n, stem)
-
-        imgs = sorted(imgs, key=_key)
-
-        out = []
-        for p in imgs:
-            parts = p.stem.split("_")
-            if len(parts) >= 2 and parts[1] in ("0", "1", "FAILED"):
-                out.append(p)
-        return out
+        # слайд декодируется воркером один раз, кропы вырезаются в памяти
+        crops = []
+        for b in boxes:
+            route = b.get("route") or self.routes.get(b["cls"], "drop")
+            if route in OCR_ROUTES:
+                crops.append(CropRef(slides[0], b["id"], b["cls"], tuple(b["box"]) if b["box"] else None, route))
+        return crops
 
     def make_payload(self, item, item_dir, img_path):
         return {
-            "image_path": str(img_path),
+            **image_payload(img_path.source),
+            "box": list(img_path.box) if img_path.box else None,
+            "route": img_path.route,
             "mode": MODE,
+            "easyocr_batch_size": EASYOCR_BATCH_SIZE,
+            "cascade": {"min_conf": OCR_CASCADE_MIN_CONF, "min_plausibility": OCR_CASCADE_MIN_PLAUSIBILITY},
         }
 
-    def iter_one(self, items):
-        for item in items:
-            item_dir = self.make_item_dir(item)
-            images = self.get_images_list(item, item_dir)
+    def cache_key(self, item, item_dir, img_path):
+        prev_key = self.cache.get_key(item_dir, "class_cutter")
+        if prev_key is None:
+            return None
+        # пакетный EasyOCR (детекция на общем холсте) может дать немного другой текст
+        cascade = (OCR_CASCADE_MIN_CONF, OCR_CASCADE_MIN_PLAUSIBILITY) if MODE == 3 else None
+        return self.cache.make_key(self.name, prev_key, img_path.name, MODE,
+                                   OCR_BATCH_PER_SLIDE and MODE in (1, 2, 3), cascade)
+
+    def store_cached(self, key, item_dir, img_path, evt):
+        payload = evt["payload"]
+        self.cache.store_put(self.name, key, {
+            "tesseract_text": payload.get("tesseract_text"),
+            "easyocr_text": payload.get("easyocr_text"),
+            "escalated": payload.get("escalated", False),
+        })
+
+    def commit_item(self, item, item_dir, results):
+        self.writer.start_image_block(item_dir.name)
+        kept = duplicate_of(item_dir)
+        if kept:
+            self.writer.add_duplicate(kept)
+        out = super().commit_item(item, item_dir, results)
+        self.writer.flush_image_block()
+        # дальше кадры этого изображения никому не нужны
+        self.cache.release_frames(item_dir)
+        return out
 
-            self.writer.start_image_block(item_dir.name)
+    def print_event(self, evt):
+        self.pool.print_event(
+            evt,
+            truncate_payload_keys=("tesseract_text", "easyocr_text"),
+            max_len=30,
+        )
 
-            for img_path in images:
-                payload = self.make_payload(item, item_dir, img_path)
-                evt = self.worker.request(self.req_id, "do", payload)
+    def on_success(self, item, item_dir, img_path, evt):
+        add_ocr_result(self, evt.get("payload") or {})
+
+    def save_result(self):
+        self.writer.end()
+        self.writer.close()
 
-                self.worker.print_event(
-                    evt,
-                    truncate_payload_keys=("tesseract_text", "easyocr_text"),
-                    max_len=30,
-                )
 
-                if evt.get("ok"):
-                    self.on_success(item, item_dir, img_path, evt)
-                else:
-                    self.on_error(item, item_dir, img_path, evt)
+def add_ocr_result(stage, payload):
+    """Текст одного кропа в ResultWriter стадии."""
+    if MODE == 3:
+        # каскад: в результат идёт один текст - easyocr, если кроп был эскалирован
+        escalated = payload.get("escalated")
+        if escalated and stage.metrics is not None:
+            stage.metrics.count(stage.name, "escalated")
+        stage.writer.add(t_text=payload.get("easyocr_text") if escalated else payload.get("tesseract_text"))
+        return
+    stage.writer.add(
+        t_text=payload.get("tesseract_text"),
+        e_text=payload.get("easyocr_text"),
+    )
+
+
+class FusedStage(Stage):
+    """
+    FUSED_PIPELINE: whiteboard, class cutter и OCR в одном процессе (fused_worker.py),
+    один запрос do на фотографию - в ответе тексты кропов в порядке чтения.
+    """
+
+    def __init__(self, cache, writer, figures_dir=None, **opts):
+        super().__init__(name="fused", worker_script=WORKER_SCRIPTS["fused"], cache=cache, **opts)
+        self.writer = writer
+        self.routes = class_routes()
+        self.figures_dir = Path(figures_dir) if figures_dir else Path(FIGURES_DIRNAME)
+
+    def start_hook(self):
+        p = self.writer.open()
+        print(f"[ok] result file: {p}")
+        if classes_for("figure"):
+            self.figures_dir.mkdir(parents=True, exist_ok=True)
 
-                self.req_id += 1
+    def get_images_list(self, item, item_dir):
+        return [Path(item)]
+
+    def make_payload(self, item, item_dir, img_path):
+        return {
+            "image_path": str(img_path),
+            "target_class": TARGET_CLASS,
+            "target_strategy": TARGET_STRATEGY,
+            "decode_reduction": WHITEBOARD_DECODE_REDUCTION,
+            "whiteboard_fallback": not WHEN_ERRORS_IN_WHITEBOARD_DELETE_DIR,
+            "classes": classes_for(*OCR_ROUTES, "figure"),
+            "figures": {"classes": classes_for("figure"), "dir": str(self.figures_dir), "prefix": item_dir.name},
+            "class_cutter_fallback": not WHEN_ERRORS_IN_CLASSCUTTER_IGNORE_DIR,
+            "routes": {str(cls): route for cls, route in self.routes.items()},
+            "mode": MODE,
+            "easyocr_batch_size": EASYOCR_BATCH_SIZE,
+            "cascade": {"min_conf": OCR_CASCADE_MIN_CONF, "min_plausibility": OCR_CASCADE_MIN_PLAUSIBILITY},
+        }
+
+    def cache_key(self, item, item_dir, img_path):
+        if self.cache.store_root is None:
+            return None
+        cascade = (OCR_CASCADE_MIN_CONF, OCR_CASCADE_MIN_PLAUSIBILITY) if MODE == 3 else None
+        return self.cache.make_key(
+            self.name, self.cache.hash_file(img_path),
+            TARGET_CLASS, TARGET_STRATEGY, WHITEBOARD_DECODE_REDUCTION,
+            WHEN_ERRORS_IN_WHITEBOARD_DELETE_DIR, WHEN_ERRORS_IN_CLASSCUTTER_IGNORE_DIR,
+            weights_digest("whiteboard"), weights_digest("class_cutter"), self.worker_info("backend"),
+            sorted(self.routes.items()), MODE, cascade,
+        )
 
+    def load_cached(self, item, item_dir, img_path, entry_dir, meta):
+        figures = []
+        for name in meta["figures"]:
+            shutil.copy2(entry_dir / name, self.figures_dir / name)
+            figures.append(str(self.figures_dir / name))
+        return {"type": "result", "id": None, "ok": True,
+                "payload": {"crops": meta["crops"], "figures": figures, "errors": meta.get("errors", []),
+                            "cached": True}}
+
+    def store_cached(self, key, item_dir, img_path, evt):
+        payload = evt["payload"]
+        files = {Path(p).name: p for p in payload.get("figures", [])}
+        self.cache.store_put(self.name, key, {"crops": payload["crops"], "figures": list(files),
+                                              "errors": payload.get("errors", [])}, files)
+
+    def commit_item(self, item, item_dir, results):
+        # как при удалении директории в handle_error_whiteboard: неудачная фотография не попадает в результат
+        if all(evt.get("ok") for _, evt in results):
+            self.writer.start_image_block(item_dir.name)
+            out = super().commit_item(item, item_dir, results)
             self.writer.flush_image_block()
+            return out
+        return super().commit_item(item, item_dir, results)
 
-        self.writer.end()
+    def print_event(self, evt):
+        self.pool.print_event(evt, truncate_payload_keys=("text",), max_len=30)
 
     def on_success(self, item, item_dir, img_path, evt):
         payload = evt.get("payload") or {}
-        self.writer.add(
-            t_text=payload.get("tesseract_text"),
-            e_text=payload.get("easyocr_text"),
-        )
+        for crop in payload.get("crops", []):
+            add_ocr_result(self, crop)
+        # пропущенное воркером (ошибка class cutter, кропы с ошибкой OCR) - как ошибки соответствующих стадий
+        for err in payload.get("errors", []):
+            print(f"[warn] {img_path}: {err['stage']} {err.get('crop', '')}: {err['error']}")
+            if self.metrics is not None:
+                self.metrics.count(self.name, f"{err['stage']}_errors")
+
+    def on_error(self, item, item_dir, img_path, evt):
+        print(f"[warn] {img_path}: {evt.get('error')}")
 
     def save_result(self):
+        self.writer.end()
         self.writer.close()
 
 
+class SlideDedupStage:
+    """
+    Подряд идущие снимки одного слайда: хэш выровненного слайда (считает whiteboard_worker.py)
+    сравнивается с предыдущим снимком. Серия похожих снимков проходит дальше целиком, но class cutter
+    и OCR работают только с последним (при пошаговом показе слайда на нём больше всего текста),
+    более ранние помечаются в директории изображения, и ResultWriter пишет для них ссылку на последний.
+    Серия отдаётся дальше, когда встречен непохожий снимок. Без воркеров - всё в оркестраторе.
+    """
+
+    def __init__(self, cache, max_distance=SLIDE_DEDUP_MAX_DISTANCE, metrics=None):
+        self.name = "dedup"
+        self.cache = cache
+        self.max_distance = max_distance
+        self.metrics = metrics
+
+    def run(self, items):
+        print(f"\n--- STAGE: {self.name} ---")
+        self.init()
+        out = list(self.iter_items(items))
+        self.end()
+        print(f"--- STAGE DONE: {self.name} ---\n")
+        return out
+
+    def launch(self):
+        pass
+
+    def init(self):
+        pass
+
+    def end(self):
+        pass
+
+    def same_slide(self, a, b):
+        return a is not None and b is not None and hash_distance(a, b) <= self.max_distance
+
+    def iter_items(self, items):
+        run = []  # [(директория, хэш)] - серия похожих снимков подряд
+        for item_dir in items:
+            slide_hash = load_slide_hash(item_dir)
+            if run and self.same_slide(run[-1][1], slide_hash):
+                run.append((item_dir, slide_hash))
+                continue
+            yield from self.flush(run)
+            run = [(item_dir, slide_hash)]
+        yield from self.flush(run)
+
+    def flush(self, run):
+        if not run:
+            return
+        kept = run[-1][0]
+        for item_dir, _ in run[:-1]:
+            (item_dir / DUPLICATE_FILENAME).write_text(kept.name, encoding="utf-8")
+            # кадр повтора дальше не нужен
+            self.cache.release_frames(item_dir)
+            print(f"[dedup] {item_dir.name} ~ {kept.name}")
+
+        if self.metrics is not None:
+            # стадия ничего не вычисляет - только сколько снимков оставлено и пропущено
+            self.metrics.note(self.name, "kept")
+            self.metrics.note(self.name, "skipped", len(run) - 1)
+        for item_dir, _ in run:
+            yield item_dir
+
+
+class StreamingPipeline:
+    """
+    Потоковый режим: воркеры всех стадий подняты одновременно,
+    каждый элемент проходит весь пайплайн через ограниченные очереди.
+    Время работы стремится к времени самой медленной стадии, а не к сумме.
+    """
+
+    _END = object()
+
+    def __init__(self, stages, queue_size=STREAM_QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self._errors = []
+
+    def run(self, items):
+        print(f"\n--- PIPELINE: {' -> '.join(s.name for s in self.stages)} ---")
+        # модели всех стадий грузятся параллельно; каждая стадия начинает работу,
+        # как только готовы её воркеры
+        for stage in self.stages:
+            stage.launch()
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), name="feed", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(stage, queues[i], queues[i + 1]),
+                name=f"stage:{stage.name}", daemon=True,
+            ))
+        for t in threads:
+            t.start()
+
+        out = list(self._drain(queues[-1]))
+        for t in threads:
+            t.join()
+
+        for stage in self.stages:
+            stage.end()
+        print("--- PIPELINE DONE ---\n")
+
+        if self._errors:
+            raise self._errors[0]
+        return out
+
+    def _drain(self, q):
+        while True:
+            item = q.get()
+            if item is self._END:
+                return
+            yield item
+
+    def _feed(self, items, q_out):
+        try:
+            for item in items:
+                if self._errors:
+                    break
+                q_out.put(item)
+        finally:
+            q_out.put(self._END)
+
+    def _run_stage(self, stage, q_in, q_out):
+        src = self._drain(q_in)
+        try:
+            stage.init()
+            for out in stage.iter_items(src):
+                q_out.put(out)
+        except Exception as e:
+            print(f"[error] stage {stage.name} failed: {e}")
+            self._errors.append(e)
+            # разгружаем вход, чтобы не заблокировать предыдущую стадию
+            for _ in src:
+                pass
+        finally:
+            q_out.put(self._END)
+
+
 
 def main():
-    cache = Cache("cache", IMG_EXTS)
+    cache = Cache("cache", IMG_EXTS, store_root=STAGE_CACHE_DIR)
     cache.clear_root()
 
     dir_with_images = Path(DIR_WITH_IMAGES_FOR_ANALYZE)
     items_for_stage1 = cache.list_images(dir_with_images)
-    stage1 = WhiteboardStage(cache)
-    stage1.run(items_for_stage1)
-
-    items_for_stage2 = cache.list_dirs()
-    stage2 = ClassCutterStage(cache)
-    stage2.run(items_for_stage2)
-
     writer = ResultWriter(result_dir=RESULT_SAVE_DIR, filename="result.txt", mode=MODE)
-    items_for_stage3 = cache.list_dirs()
-    stage3 = OCRStage(cache, writer)
-    stage3.run(items_for_stage3)
+
+    if TRACE_FILENAME:
+        tracing.enable()
+        tracing.process_name(os.getpid(), "orchestrator")
+
+    metrics = Metrics()
+    metrics.inputs = len(items_for_stage1)
+    pool_opts = dict(window=WORKER_WINDOW, threads=WORKER_THREADS, socket_dir=WORKER_DAEMON_DIR or None,
+                     metrics=metrics)
+    figures_dir = writer.result_dir / FIGURES_DIRNAME
+    pools = {}
+    if MODEL_HOST_MODELS and not FUSED_PIPELINE:
+        # модели этих стадий - в одном процессе; окно и потоки - чтобы стадии не ждали друг друга
+        stage_workers = {"whiteboard": WHITEBOARD_WORKERS, "class_cutter": CLASS_CUTTER_WORKERS, "ocr": OCR_WORKERS}
+        host = WorkerPool(
+            WORKER_SCRIPTS["model_host"], size=max(stage_workers[n] for n in MODEL_HOST_MODELS),
+            window=WORKER_WINDOW * len(MODEL_HOST_MODELS), threads=max(WORKER_THREADS, len(MODEL_HOST_MODELS)),
+            socket_dir=WORKER_DAEMON_DIR or None, name="model_host", metrics=metrics,
+        )
+        pools = {name: host for name in MODEL_HOST_MODELS}
+    if FUSED_PIPELINE:
+        fused = FusedStage(cache, writer, figures_dir=figures_dir, workers=FUSED_WORKERS, **pool_opts)
+    else:
+        stage1 = WhiteboardStage(cache, workers=WHITEBOARD_WORKERS, batch_size=WHITEBOARD_BATCH_SIZE,
+                                 pool=pools.get("whiteboard"), **pool_opts)
+        stage2 = ClassCutterStage(cache, figures_dir=figures_dir, workers=CLASS_CUTTER_WORKERS,
+                                  batch_size=CLASS_CUTTER_BATCH_SIZE, pool=pools.get("class_cutter"), **pool_opts)
+        stage3 = OCRStage(cache, writer, workers=OCR_WORKERS, pool=pools.get("ocr"), **pool_opts)
+        dedup = SlideDedupStage(cache, metrics=metrics) if SLIDE_DEDUP else None
+
+    try:
+        if FUSED_PIPELINE:
+            fused.launch()
+            fused.run(items_for_stage1)
+        elif PIPELINE_STREAMING:
+            stages = [stage1, dedup, stage2, stage3] if dedup else [stage1, stage2, stage3]
+            pipeline = StreamingPipeline(stages, queue_size=STREAM_QUEUE_SIZE)
+            pipeline.run(items_for_stage1)
+        else:
+            for stage in (stage1, stage2, stage3):
+                stage.launch()
+
+            stage1.run(items_for_stage1)
+            if dedup:
+                dedup.run(cache.list_dirs())
+
+            items_for_stage2 = cache.list_dirs()
+            stage2.run(items_for_stage2)
+
+            items_for_stage3 = cache.list_dirs()
+            stage3.run(items_for_stage3)
+    finally:
+        cache.release_frames()
+
+    if SUMMARY_FILENAME:
+        summary_path = writer.result_dir / SUMMARY_FILENAME
+        summary = metrics.write(summary_path)
+        print(f"[ok] run summary: {summary_path}")
+        for name, st in summary["stages"].items():
+            total = st["latency_ms"]["total"]
+            print(f"  {name}: {st['images']} images, {st['errors']} errors, {st['cached']} cached, "
+                  f"{st['images_per_s']} img/s, p50={total['p50']} ms, p95={total['p95']} ms")
+            for key, c in st["counts"].items():
+                print(f"    {key}: {c['n']} ({c['rate']})")
+        if "dedup" in summary:
+            dedup = summary["dedup"]
+            print(f"  dedup: kept {dedup.get('kept', 0)}, skipped {dedup.get('skipped', 0)}")
+        rss = summary["peak_rss_mb"]
+        print(f"  peak RSS: {rss['total']} MB ({rss['processes']} processes, orchestrator {rss['orchestrator']} MB)")
+
+    if TRACE_FILENAME:
+        trace_path = writer.result_dir / TRACE_FILENAME
+        n = tracing.write(trace_path)
+        print(f"[ok] trace ({n} events): {trace_path}")
 
     if DELETE_CACHE_AFTER_COMPLETION:
         cache.clear_root()
@@ -0,0 +1,142 @@
+"""
+Все три стадии в одном процессе: whiteboard -> class cutter -> OCR.
+
+Для интерактивных запросов по одной фотографии (FUSED_PIPELINE = True в core.py,
+или постоянно загруженный worker_daemon.py fused_worker.py): один запрос do
+на фотографию, полный кадр декодируется один раз (при decode_reduction > 1 детекция
+идёт по отдельному уменьшенному декодированию), выровненный слайд и кропы - массивы
+в памяти, torch / ultralytics / easyocr импортируются один раз. Ответ - сразу текст.
+
+Ошибки - как в стадиях core.py: при ошибке whiteboard с запасным вариантом дальше идёт
+вся фотография (если она не декодируется - пустой текст), при ошибке class cutter без
+запасного варианта - пустой текст, кроп с ошибкой OCR пропускается; что пропущено -
+в errors ответа.
+"""
+from baseOCR2_worker import BaceOCRWorker, crop_box
+from class_cutter_worker import ClassCutterWorker
+from whiteboard_worker import WhiteboadWorker
+from worker_base import BaseWorker
+
+
+class FusedWorker(BaseWorker):
+    def __init__(self):
+        super().__init__()
+        self.whiteboard = WhiteboadWorker()
+        self.cutter = ClassCutterWorker()
+        self.ocr = BaceOCRWorker()
+
+
+    def on_start(self):
+        wb = self.whiteboard.on_start()
+        cc = self.cutter.on_start()
+        ocr = self.ocr.on_start()
+        return {
+            "name": "fused-worker",
+            "ready": True,
+            "backend": {"whiteboard": wb.get("backend"), "class_cutter": cc.get("backend")},
+            "tesseract_engine": ocr.get("tesseract_engine"),
+        }
+
+
+    def warmup(self):
+        self.whiteboard.warmup()
+        self.cutter.warmup()
+        self.ocr.warmup()
+
+
+    def _warp(self, payload, errors):
+        wb = self.whiteboard
+        full = img = None
+        try:
+            small, full = wb._read_for_detection(payload)
+            pred = wb._predict(small)
+            del small
+            img = full.result()
+            return wb._process_image(
+                img, target_class=payload["target_class"],
+                target_strategy=payload.get("target_strategy", "conf"), pred=pred,
+            )
+        except Exception as e:
+            if not payload.get("whiteboard_fallback"):
+                raise
+            error = str(e)
+
+        # как WHEN_ERRORS_IN_WHITEBOARD_DELETE_DIR = False: дальше идёт вся фотография
+        if img is None:
+            try:
+                img = full.result() if full is not None else wb._read(payload)
+            except Exception as e:
+                # кадр не декодируется - пустой блок
+                error = f"cannot decode frame: {e}"
+        errors.append({"stage": "whiteboard", "error": error})
+        return img
+
+
+    def _boxes(self, warp, payload, errors):
+        try:
+            return self.cutter._finish(warp, payload)["boxes"]
+        except Exception as e:
+            errors.append({"stage": "class_cutter", "error": str(e)})
+            # как WHEN_ERRORS_IN_CLASSCUTTER_IGNORE_DIR = False: весь слайд - один кроп печатного текста
+            if payload.get("class_cutter_fallback"):
+                return [{"id": 0, "cls": 0, "box": None, "route": "ocr_printed"}]
+            # иначе, как OCRStage без boxes.json, - пустой блок
+            return []
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        errors = []
+        warp = self._warp(payload, errors)
+        if warp is None:
+            return {"text": "", "crops": [], "figures": [], "errors": errors}
+        boxes = self._boxes(warp, payload, errors)
+
+        routes = {int(k): v for k, v in payload["routes"].items()}
+        crops = []
+        for b in boxes:
+            route = b.get("route") or routes.get(b["cls"], "drop")
+            if route in ("ocr_printed", "ocr_handwritten"):
+                crops.append({"id": b["id"], "cls": b["cls"], "route": route, "img": crop_box(warp, b["box"])})
+
+        ocr_payloads = [{
+            "route": c["route"],
+            "mode": payload["mode"],
+            "cascade": payload.get("cascade"),
+            "easyocr_batch_size": payload.get("easyocr_batch_size", 16),
+        } for c in crops]
+        results = self.ocr.handle_batch("do", ocr_payloads, imgs=[c["img"] for c in crops]) if crops else []
+
+        out = []
+        for c, res in zip(crops, results):
+            if not res["ok"]:
+                # как OCRStage: кроп с ошибкой пропускается, остальные идут в результат
+                errors.append({"stage": "ocr", "crop": f"{c['id']}_{c['cls']}", "error": res["error"]})
+                continue
+            out.append({"id": c["id"], "cls": c["cls"], "route": c["route"], **res["payload"]})
+        return {
+            "text": "\n\n".join(t for t in (self._crop_text(c, payload["mode"]) for c in out) if t),
+            "crops": out,
+            "figures": [b["figure"] for b in boxes if b.get("figure")],
+            "errors": errors,
+        }
+
+
+    def _crop_text(self, crop, mode):
+        # MODE 2 - основной текст tesseract, easyocr остаётся в crops
+        if mode == 1 or (mode == 3 and crop.get("escalated")):
+            return crop["easyocr_text"]
+        return crop["tesseract_text"]
+
+
+    def on_shutdown(self):
+        self.whiteboard.on_shutdown()
+        self.cutter.on_shutdown()
+        self.ocr.on_shutdown()
+        return {"bye": True}
+
+
+if __name__ == "__main__":
+    FusedWorker().run()
@@ -0,0 +1,97 @@
+"""
+Несколько моделей в одном процессе воркера: один интерпретатор, один torch / ultralytics
+(и CUDA-контекст) на модели нескольких стадий вместо процесса на стадию.
+
+Какие модели загружать, задаёт core.py (MODEL_HOST_MODELS) через окружение:
+    CONSPECT_HOST_MODELS  "whiteboard=whiteboard_worker.py,class_cutter=class_cutter_worker.py"
+Запрос направляется модели по ключу payload["model"] (имя стадии); do_batch - целиком одной модели.
+Запросы к разным моделям выполняются параллельно (потоки воркера), к одной модели - по очереди.
+
+Сервер моделей:
+    CONSPECT_HOST_MODELS=whiteboard=whiteboard_worker.py,class_cutter=class_cutter_worker.py \\
+        python worker_daemon.py model_host_worker.py --threads 2
+"""
+import importlib
+import inspect
+import os
+import sys
+import threading
+from pathlib import Path
+
+from worker_base import BaseWorker
+
+
+def host_models(spec=None):
+    """{ключ модели: скрипт воркера} из CONSPECT_HOST_MODELS."""
+    spec = os.environ.get("CONSPECT_HOST_MODELS", "") if spec is None else spec
+    out = {}
+    for part in spec.split(","):
+        key, _, script = part.partition("=")
+        if key.strip() and script.strip():
+            out[key.strip()] = script.strip()
+    return out
+
+
+def load_worker_class(worker_script):
+    script = Path(worker_script)
+    if str(script.parent) not in sys.path:
+        sys.path.insert(0, str(script.parent))
+    module = importlib.import_module(script.stem)
+    for obj in vars(module).values():
+        if inspect.isclass(obj) and issubclass(obj, BaseWorker) and obj.__module__ == module.__name__:
+            return obj
+    raise RuntimeError(f"no BaseWorker subclass in {worker_script}")
+
+
+class ModelHostWorker(BaseWorker):
+    def __init__(self, models=None):
+        super().__init__()
+        self.scripts = models if models is not None else host_models()
+        if not self.scripts:
+            raise RuntimeError("no models to host: set CONSPECT_HOST_MODELS")
+        self.models = {key: load_worker_class(script)() for key, script in self.scripts.items()}
+        self._locks = {key: threading.Lock() for key in self.models}
+
+
+    def on_start(self):
+        # started каждой модели - под её ключом (backend и т.п. для ключа кэша стадии)
+        started = {key: worker.on_start() for key, worker in self.models.items()}
+        return {"name": "model-host", "ready": True, "models": started}
+
+
+    def warmup(self):
+        for worker in self.models.values():
+            worker.warmup()
+
+
+    def _model(self, payload):
+        key = payload.get("model")
+        if key not in self.models:
+            raise ValueError(f"unknown model: {key} (hosted: {', '.join(self.models)})")
+        return key, self.models[key]
+
+
+    def handle(self, op, payload):
+        key, worker = self._model(payload)
+        # пока модель занята запросом другой стадии (окно пула общее), время идёт в очередь, а не в compute
+        with self.waiting(self._locks[key]):
+            return worker.handle(op, payload)
+
+
+    def handle_batch(self, op, payloads):
+        keys = {p.get("model") for p in payloads}
+        if len(keys) != 1:
+            raise ValueError(f"do_batch must target one model, got: {sorted(map(str, keys))}")
+        key, worker = self._model(payloads[0])
+        with self.waiting(self._locks[key]):
+            return worker.handle_batch(op, payloads)
+
+
+    def on_shutdown(self):
+        for worker in self.models.values():
+            worker.on_shutdown()
+        return {"bye": True}
+
+
+if __name__ == "__main__":
+    ModelHostWorker().run()
@@ -0,0 +1,80 @@
+"""
+Передача декодированных кадров между процессами через multiprocessing.shared_memory.
+
+По JSONL-каналу идёт только дескриптор {"shm", "shape", "dtype"}.
+Сегмент создаёт воркер-производитель, удаляет оркестратор (release_frame),
+когда кадр больше никому не нужен.
+"""
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+FRAME_FILE_EXT = ".png"    # постоянный кэш: PNG - без потерь и в разы меньше сырого кадра
+PNG_COMPRESSION = 1    # 0-9;  выше уровень - почти тот же размер, но медленнее запись
+
+
+def _untrack(shm):
+    # временем жизни сегмента управляет оркестратор, а не resource_tracker процесса,
+    # иначе сегмент удалится при выходе воркера
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def put_frame(img):
+    img = np.ascontiguousarray(img)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+    _untrack(shm)
+    try:
+        buf = np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)
+        buf[...] = img
+        del buf
+    finally:
+        shm.close()
+    return {"shm": shm.name, "shape": list(img.shape), "dtype": str(img.dtype)}
+
+
+def get_frame(handle):
+    shm = shared_memory.SharedMemory(name=handle["shm"])
+    _untrack(shm)
+    try:
+        buf = np.ndarray(tuple(handle["shape"]), dtype=np.dtype(handle["dtype"]), buffer=shm.buf)
+        img = buf.copy()
+        del buf
+    finally:
+        shm.close()
+    return img
+
+
+def save_frame(handle, path):
+    """Кадр из shared memory в PNG без потерь (постоянный кэш стадий)."""
+    shm = shared_memory.SharedMemory(name=handle["shm"])
+    _untrack(shm)
+    try:
+        buf = np.ndarray(tuple(handle["shape"]), dtype=np.dtype(handle["dtype"]), buffer=shm.buf)
+        ok, data = cv2.imencode(FRAME_FILE_EXT, buf, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+        del buf
+    finally:
+        shm.close()
+    if not ok:
+        raise OSError(f"failed to encode frame: {path}")
+    data.tofile(str(path))
+
+
+def load_frame(path):
+    """Файл кадра (save_frame) -> новый кадр в shared memory."""
+    img = cv2.imdecode(np.fromfile(str(path), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise OSError(f"cannot read frame: {path}")
+    return put_frame(img)
+
+
+def release_frame(handle):
+    try:
+        shm = shared_memory.SharedMemory(name=handle["shm"])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
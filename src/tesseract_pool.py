@@ -0,0 +1,93 @@
+"""
+Tesseract внутри процесса воркера (tesserocr) вместо запуска tesseract на каждый кроп.
+
+Хэндлы PyTessBaseAPI создаются один раз на пару (lang, psm) и переиспользуются:
+traineddata загружается при создании хэндла, а не на каждый кроп.
+Один хэндл не потокобезопасен, поэтому при WORKER_THREADS > 1 на ключ
+держится столько хэндлов, сколько потоков одновременно распознают.
+Кроп передаётся в память (SetImageBytes), без временного файла.
+"""
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+def api_available():
+    try:
+        import tesserocr  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class TesseractPool:
+    def __init__(self, oem=3, variables=None):
+        self.oem = oem
+        self.variables = dict(variables or {})
+        self._free = {}
+        self._all = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _create(self, lang, psm):
+        from tesserocr import PyTessBaseAPI
+
+        api = PyTessBaseAPI(lang=lang, psm=psm, oem=self.oem)
+        for name, value in self.variables.items():
+            if not api.SetVariable(name, str(value)):
+                raise ValueError(f"unknown tesseract variable: {name}")
+        with self._lock:
+            self._all.append(api)
+        return api
+
+    @contextmanager
+    def acquire(self, lang, psm):
+        with self._lock:
+            free = self._free.setdefault((lang, psm), [])
+            api = free.pop() if free else None
+        if api is None:
+            api = self._create(lang, psm)
+        try:
+            yield api
+        finally:
+            self._release(lang, psm, api)
+
+    def _release(self, lang, psm, api):
+        with self._lock:
+            if not self._closed:
+                self._free.setdefault((lang, psm), []).append(api)
+                return
+            self._all.remove(api)
+        # пул уже закрыт - хэндл завершает тот, кто его держал
+        api.End()
+
+    def image_to_string(self, img, lang, psm):
+        return self.image_to_data(img, lang, psm, confidences=False)[0]
+
+    def image_to_data(self, img, lang, psm, confidences=True):
+        """Текст и уверенности (0-100) по словам."""
+        if img.ndim == 3:
+            # tesseract ждёт RGB
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        h, w = img.shape[:2]
+        bpp = 1 if img.ndim == 2 else img.shape[2]
+
+        with self.acquire(lang, psm) as api:
+            api.SetImageBytes(img.tobytes(), w, h, bpp, w * bpp)
+            text = api.GetUTF8Text()
+            confs = list(api.AllWordConfidences()) if confidences else []
+            api.Clear()
+        return text, confs
+
+    def close(self):
+        # занятые хэндлы завершаются при возврате (_release)
+        with self._lock:
+            self._closed = True
+            apis = [api for free in self._free.values() for api in free]
+            self._free = {}
+            self._all = [api for api in self._all if api not in apis]
+        for api in apis:
+            api.End()
@@ -0,0 +1,108 @@
+"""
+Спаны в формате Trace Event Format (открывается в Perfetto / chrome://tracing).
+
+Воркеры включают запись переменной окружения CONSPECT_TRACE=1 (её выставляет
+оркестратор) и возвращают накопленные события в поле "trace" каждого result;
+оркестратор собирает всё в один файл, по треку на процесс.
+Время - общие для всех процессов микросекунды (time.time_ns).
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+_enabled = os.environ.get("CONSPECT_TRACE") == "1"
+_events = []
+_thread_names = {}
+_lock = threading.Lock()
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def enabled():
+    return _enabled
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+def add(event):
+    with _lock:
+        _events.append(event)
+
+
+def extend(events):
+    """События из другого процесса (поле "trace" ответа воркера)."""
+    with _lock:
+        _events.extend(events)
+
+
+def add_span(name, ts, dur, cat="worker", **args):
+    pid, tid = os.getpid(), threading.get_ident()
+    _thread_names[(pid, tid)] = threading.current_thread().name
+    add({"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": pid, "tid": tid, "args": args})
+
+
+@contextmanager
+def span(name, cat="worker", **args):
+    if not _enabled:
+        yield
+        return
+    t0 = now_us()
+    try:
+        yield
+    finally:
+        add_span(name, t0, now_us() - t0, cat=cat, **args)
+
+
+def traced(name=None, cat="worker"):
+    """Декоратор: спан на каждый вызов функции (при выключенной трассировке - только проверка флага)."""
+    def deco(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with span(span_name, cat=cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def async_span(name, key, ts, dur, cat, **args):
+    """Перекрывающиеся интервалы (например, запросы в полёте) - отдельными async-слайсами."""
+    pid = os.getpid()
+    add({"name": name, "cat": cat, "ph": "b", "id": str(key), "ts": ts, "pid": pid, "tid": pid, "args": args})
+    add({"name": name, "cat": cat, "ph": "e", "id": str(key), "ts": ts + dur, "pid": pid, "tid": pid})
+
+
+def drain():
+    """Забрать накопленные события процесса (с именами потоков)."""
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    pid = os.getpid()
+    seen = {(e["pid"], e["tid"]) for e in events if e.get("ph") == "X" and e["pid"] == pid}
+    for pid, tid in seen:
+        events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid,
+                       "args": {"name": _thread_names.get((pid, tid), str(tid))}})
+    return events
+
+
+def process_name(pid, name):
+    add({"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": name}})
+
+
+def write(path):
+    events = drain()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return len(events)
@@ -1,36 +1,66 @@
 import cv2
 import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from ultralytics import YOLO
 
 from worker_base import BaseWorker
+from yolo_backend import load_yolo
+from shm_frames import put_frame
+from tracing import span, traced
+
+
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+DETECT_MIN_SIDE = 640    # вход модели; уменьшенный кадр меньше этого не используется
+
+
+def slide_hash(img, size=16):
+    """Разностный хэш (dHash) выровненного слайда: size*size бит в hex, для поиска повторных снимков."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    # порог в 1 уровень: на пустом фоне слайда биты не зависят от шума снимка
+    return np.packbits(small[:, 1:] > small[:, :-1] + 1).tobytes().hex()
+
+
+def _done(value):
+    fut = Future()
+    fut.set_result(value)
+    return fut
+
 
 class WhiteboadWorker(BaseWorker):
     def __init__(self):
         super().__init__()
         self.model = None
+        self.decoder = None
 
 
     def on_start(self):
         HERE = Path(__file__).resolve().parent
         weights = HERE.parent / 'weights' / 'whiteboard' / 'best.pt'
-        if not weights.exists():
-            raise FileNotFoundError(f"Weights not found: {weights}")
 
-        self.model = YOLO(str(weights))
-        return {"name": "whiteboard-worker", "ready": True}
+        self.model = load_yolo(weights)
+        # полный кадр декодируется, пока модель работает с уменьшенным
+        self.decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode")
+        return {"name": "whiteboard-worker", "ready": True, "backend": self.model.name}
+
+
+    def warmup(self):
+        self._predict(np.zeros((640, 640, 3), dtype=np.uint8))
 
 
     def _predict(self, img):
-        pred = self.model.predict(
-            source=img,
-            conf=0.25,
-            iou=0.5,
-            device="cuda",
-            save=False,
-            verbose=False
-        )[0]
-        return pred
+        return self._predict_batch([img])[0]
+
+
+    @traced("_predict")
+    def _predict_batch(self, imgs):
+        preds = self.model.predict(imgs, conf=0.25, iou=0.5)
+        return preds
 
 
     def _select_detection_index(self, pred, target_class=None, target_strategy="conf"):
@@ -58,13 +88,28 @@ class WhiteboadWorker(BaseWorker):
             return int(idxs[np.argmax(sizes[idxs])])
 
 
-    def _mask_for_index(self, pred, idx, W, H):
+    @traced()
+    def _quad_for_index(self, pred, idx, W, H):
+        """
+        Четырёхугольник по маске в её собственном разрешении (разрешение модели),
+        затем в координаты кадра W x H с учётом letterbox-полей.
+        Полноразмерная маска не растеризуется.
+        """
         mask = pred.masks.data[idx].detach().cpu().numpy()
         if mask.ndim == 3:
             mask = mask[0]
-        mask = cv2.resize(mask, (W, H), cv2.INTER_NEAREST)
         mask = (mask > 0.5).astype(np.uint8) * 255
-        return mask
+        mh, mw = mask.shape[:2]
+
+        cnt = self._largest_contour(mask)
+        box = self._quad_from_contour(cnt).astype(np.float32)
+
+        gain = min(mh / H, mw / W)
+        pad_x, pad_y = (mw - W * gain) / 2, (mh - H * gain) / 2
+        # центры пикселей маски -> центры пикселей кадра
+        box[:, 0] = np.clip((box[:, 0] + 0.5 - pad_x) / gain - 0.5, 0, W - 1)
+        box[:, 1] = np.clip((box[:, 1] + 0.5 - pad_y) / gain - 0.5, 0, H - 1)
+        return box
 
 
     def _largest_contour(self, mask):
@@ -106,56 +151,124 @@ class WhiteboadWorker(BaseWorker):
         return w, h
 
 
-    def _warp_perspective_rgb(self, img_rgb, src):
+    @traced()
+    def _warp_perspective(self, img, src):
         w, h = self._compute_warp_size(src)
         dst = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32)
         M = cv2.getPerspectiveTransform(src, dst)
-        return cv2.warpPerspective(img_rgb, M, (w, h))
+        return cv2.warpPerspective(img, M, (w, h))
 
 
-    def _process_image(self, img, target_class=None, target_strategy='conf'):
-        pred = self._predict(img)
+    def _process_image(self, img, target_class=None, target_strategy='conf', pred=None):
+        """img - полный кадр BGR; pred может быть посчитан по уменьшенной копии того же кадра."""
+        if pred is None:
+            pred = self._predict(img)
         H, W = img.shape[:2]
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
         idx = self._select_detection_index(
             pred, target_class=target_class, target_strategy=target_strategy
         )
-        mask = self._mask_for_index(pred, idx=idx, W=W, H=H)
-        cnt = self._largest_contour(mask)
-        box = self._quad_from_contour(cnt)
+        # маска в пропорциях кадра - четырёхугольник сразу в координатах полного кадра
+        box = self._quad_for_index(pred, idx=idx, W=W, H=H)
         src = self._order_points_tl_tr_br_bl(box)
-        warp = self._warp_perspective_rgb(img_rgb, src)
+        warp = self._warp_perspective(img, src)
 
         return warp
 
 
-    def handle(self, op, payload):
-        if op != "do":
-            raise ValueError(f"unknown op: {op}")
-
+    def _read(self, payload, reduction=1):
         image_path = str(payload["image_path"])
-        out_path = str(payload["out_path"])
-        target_class = payload["target_class"]
-
-        img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        with span("cv2.imread"):
+            img = cv2.imread(image_path, REDUCED_READ_FLAGS[reduction])
         if img is None:
             raise FileNotFoundError(f"cannot read image: {image_path}")
+        return img
+
+
+    def _read_later(self, payload):
+        if self.decoder is None:
+            return _done(self._read(payload))
+        return self.decoder.submit(self._read, payload)
+
+
+    def _read_for_detection(self, payload):
+        """
+        Кадр для YOLO и Future полного кадра для warp.
+        JPEG декодируется сразу в 1/reduction размера (масштабирование в DCT), если уменьшенная
+        копия не меньше входа модели; полный кадр тем временем декодируется в self.decoder.
+        """
+        reduction = int(payload.get("decode_reduction", 1))
+        if reduction > 1:
+            small = self._read(payload, reduction)
+            if max(small.shape[:2]) >= DETECT_MIN_SIDE:
+                return small, self._read_later(payload)
+        img = self._read(payload)
+        return img, _done(img)
+
+
+    def _finish(self, img, payload, pred=None):
+        out_path = str(payload["out_path"])
+        target_class = payload["target_class"]
 
         if "target_strategy" in payload:
-            warp_rgb = self._process_image(img, target_class=target_class, target_strategy=payload["target_strategy"])
+            warp = self._process_image(img, target_class=target_class, target_strategy=payload["target_strategy"], pred=pred)
         else:
-            warp_rgb = self._process_image(img, target_class=target_class)
+            warp = self._process_image(img, target_class=target_class, pred=pred)
+
+        shm = payload.get("transport") == "shm"
+
+        with span("slide_hash"):
+            out = {"slide_hash": slide_hash(warp)}
+        if not shm or payload.get("save"):
+            with span("cv2.imwrite"):
+                ok = cv2.imwrite(out_path, warp)
+            if not ok:
+                raise RuntimeError(f"failed to write image: {out_path}")
+            out["warp_path"] = out_path
+        if shm:
+            with span("put_frame"):
+                out["warp"] = put_frame(warp)
+
+        return out
+
+
+    def handle(self, op, payload):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        small, full = self._read_for_detection(payload)
+        pred = self._predict(small)
+        del small
+        return self._finish(full.result(), payload, pred=pred)
+
+
+    def handle_batch(self, op, payloads):
+        if op != "do":
+            raise ValueError(f"unknown op: {op}")
+
+        out = [None] * len(payloads)
+        reads = {}
+        for i, payload in enumerate(payloads):
+            try:
+                reads[i] = self._read_for_detection(payload)
+            except Exception as e:
+                out[i] = {"ok": False, "error": str(e)}
 
-        warp_bgr = cv2.cvtColor(warp_rgb, cv2.COLOR_RGB2BGR)
-        ok = cv2.imwrite(out_path, warp_bgr)
-        if not ok:
-            raise RuntimeError(f"failed to write image: {out_path}")
+        idxs = list(reads)
+        preds = self._predict_batch([reads[i][0] for i in idxs]) if idxs else []
 
-        return {"warp_path": out_path}
+        for i, pred in zip(idxs, preds):
+            full = reads.pop(i)[1]
+            try:
+                out[i] = {"ok": True, "payload": self._finish(full.result(), payloads[i], pred=pred)}
+            except Exception as e:
+                out[i] = {"ok": False, "error": str(e)}
+        return out
 
 
     def on_shutdown(self):
+        if self.decoder is not None:
+            self.decoder.shutdown(wait=True)
         return {"bye": True}
 
 if __name__ == "__main__":
@@ -1,8 +1,104 @@
+import os
 import sys
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import tracing
+
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса, МБ (None, если узнать не удалось)."""
+    # VmHWM сбрасывается при exec, а ru_maxrss на Linux достаётся от родителя
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux - КБ, macOS - байты
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+_imports = threading.local()
+_import_lock = threading.Lock()
+_import_s = 0.0
+
+
+@contextmanager
+def timed_import():
+    """
+    Отложенный импорт тяжёлых модулей (torch, ultralytics, onnxruntime, easyocr) внутри on_start / warmup:
+    время идёт в import_s события started, а не в load_s / warmup_s.
+    """
+    global _import_s
+    depth = getattr(_imports, "depth", 0)
+    _imports.depth = depth + 1
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _imports.depth = depth
+        if depth == 0:
+            with _import_lock:
+                _import_s += time.perf_counter() - t0
+
+
+def imported_s():
+    """Суммарное время импортов под timed_import() в этом процессе, с."""
+    with _import_lock:
+        return _import_s
+
+
+# настройки моделей из окружения и значения, которые воркеры берут, если переменная не задана
+SETTINGS_ENV_DEFAULTS = {
+    "CONSPECT_TRACE": "0",
+    "CONSPECT_BACKEND": "auto",
+    "CONSPECT_ORT_INTRA_THREADS": "0",
+    "CONSPECT_ORT_INTER_THREADS": "0",
+    "CONSPECT_TESSERACT_ENGINE": "auto",
+    "CONSPECT_MODEL_PRECISION": "",
+    "CONSPECT_WORKER_THREADS": "1",
+    "CONSPECT_HOST_MODELS": "",
+}
+
+
+def env_settings():
+    """Настройки, с которыми загружены модели; оркестратор сверяет их у сервера моделей."""
+    return {k: os.environ.get(k) or default for k, default in SETTINGS_ENV_DEFAULTS.items()}
+
 
 class BaseWorker:
-    """Каркас JSONL-воркера."""
+    """
+    Каркас JSONL-воркера.
+    Операции: do (один payload), do_batch ({"items": [payload, ...]} ->
+    {"items": [{"ok": ..., "payload"/"error": ...}, ...]}), ext.
+    При CONSPECT_WORKER_THREADS > 1 читает запросы наперёд и обрабатывает
+    их параллельно на пуле потоков; ответы уходят по мере готовности с тем же id.
+    """
+
+    def __init__(self):
+        self._handle_lock = None  # задаётся, если воркер обслуживает несколько клиентов сразу
+        self._wait = threading.local()  # ожидание блокировок в текущем запросе, с
+
+    @contextmanager
+    def waiting(self, lock):
+        """Блокировка внутри handle: ожидание идёт в timing.wait_ms (очередь), а не в compute_ms."""
+        t0 = time.perf_counter()
+        lock.acquire()
+        self._wait.s = getattr(self._wait, "s", 0.0) + time.perf_counter() - t0
+        try:
+            yield
+        finally:
+            lock.release()
 
     def send(self, obj: dict) -> None:
         print(json.dumps(obj, ensure_ascii=False), flush=True)
@@ -10,16 +106,114 @@ class BaseWorker:
     def on_start(self):
         return {}
 
+    def warmup(self):
+        """Первый прогон модели на пустом кадре, чтобы первая реальная заявка не платила за инициализацию."""
+        pass
+
+    def startup(self):
+        """on_start + warmup с замером времени; результат уходит в событие started."""
+        launch_ts = os.environ.get("CONSPECT_LAUNCH_TS")
+        # запуск интерпретатора и импорты модулей воркера от момента запуска процесса
+        import_s = time.time() - float(launch_ts) if launch_ts else None
+
+        i0 = imported_s()
+        t0 = time.perf_counter()
+        with tracing.span("on_start"):
+            payload = self.on_start()
+        t1 = time.perf_counter()
+        i1 = imported_s()
+        with tracing.span("warmup"):
+            self.warmup()
+        t2 = time.perf_counter()
+        i2 = imported_s()
+
+        # отложенные импорты torch / ultralytics / easyocr в on_start и warmup - тоже импорты
+        if import_s is not None:
+            import_s += i2 - i0
+        timing = {
+            "import_s": round(import_s, 3) if import_s is not None else None,
+            "load_s": round(t1 - t0 - (i1 - i0), 3),
+            "warmup_s": round(t2 - t1 - (i2 - i1), 3),
+            "total_s": round(time.time() - float(launch_ts), 3) if launch_ts else None,
+        }
+        return {**payload, "pid": os.getpid(), "timing": timing, "settings": env_settings()}
+
     def handle(self, op, payload):
         return {"echo": payload}
 
+    def handle_batch(self, op, payloads):
+        """По умолчанию обрабатывает элементы по одному; воркеры с батчевым инференсом переопределяют."""
+        out = []
+        for payload in payloads:
+            try:
+                out.append({"ok": True, "payload": self.handle(op, payload)})
+            except Exception as e:
+                out.append({"ok": False, "error": str(e)})
+        return out
+
     def on_shutdown(self):
         return {}
 
-    def run(self) -> None:
-        self.send({"type": "started", "ok": True, "payload": self.on_start()})
+    def _handle_msg(self, msg_id, op, payload, send):
+        timing = {}
+        try:
+            if self._handle_lock is not None:
+                t0 = time.perf_counter()
+                with self._handle_lock:
+                    timing["wait_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                    out = self._timed_dispatch(msg_id, op, payload, timing)
+            else:
+                out = self._timed_dispatch(msg_id, op, payload, timing)
+            msg = {"type": "result", "id": msg_id, "ok": True, "payload": out, "timing": timing}
+        except Exception as e:
+            msg = {"type": "result", "id": msg_id, "ok": False, "error": str(e), "timing": timing}
+        if tracing.enabled():
+            msg["trace"] = tracing.drain()
+        send(msg)
+
+    def _timed_dispatch(self, msg_id, op, payload, timing):
+        self._wait.s = 0.0
+        t0 = time.perf_counter()
+        try:
+            with tracing.span(op, id=msg_id):
+                return self._dispatch(op, payload)
+        finally:
+            wait = self._wait.s
+            timing["compute_ms"] = round((time.perf_counter() - t0 - wait) * 1000, 3)
+            if wait:
+                timing["wait_ms"] = round(timing.get("wait_ms", 0.0) + wait * 1000, 3)
+
+    def _dispatch(self, op, payload):
+        if op == "do_batch":
+            return {"items": self.handle_batch("do", payload["items"])}
+        return self.handle(op, payload)
 
-        for line in sys.stdin:
+    def run(self, threads=None) -> None:
+        """Воркер как subprocess: JSONL через stdin/stdout."""
+        started = self.startup()
+        self.serve(sys.stdin, sys.stdout, started, threads=threads)
+
+    def serve(self, rfile, wfile, started, threads=None, shutdown=True) -> None:
+        """
+        Цикл протокола поверх пары текстовых потоков.
+        shutdown=False - по ext отвечаем bye, но on_shutdown не вызываем
+        (модели остаются загруженными для следующих клиентов).
+        """
+        if threads is None:
+            threads = int(os.environ.get("CONSPECT_WORKER_THREADS", "1"))
+        pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+
+        send_lock = threading.Lock()
+
+        def send(obj):
+            line = json.dumps(obj, ensure_ascii=False)
+            with send_lock:
+                wfile.write(line + "\n")
+                wfile.flush()
+
+        send({"type": "started", "ok": True, "payload": started})
+
+        for line in rfile:
             line = line.strip()
             if not line:
                 continue
@@ -27,7 +221,7 @@ class BaseWorker:
             try:
                 msg = json.loads(line)
             except json.JSONDecodeError:
-                self.send({"type": "result", "id": None, "ok": False, "error": "bad_json"})
+                send({"type": "result", "id": None, "ok": False, "error": "bad_json"})
                 continue
 
             msg_id = msg.get("id")
@@ -35,11 +229,17 @@ class BaseWorker:
             payload = msg.get("payload")
 
             if op == "ext":
-                self.send({"type": "result", "id": msg_id, "ok": True, "payload": self.on_shutdown()})
+                if pool is not None:
+                    pool.shutdown(wait=True)
+                bye = self.on_shutdown() if shutdown else {"bye": True}
+                bye = {**(bye or {}), "pid": os.getpid(), "peak_rss_mb": peak_rss_mb()}
+                send({"type": "result", "id": msg_id, "ok": True, "payload": bye})
                 return
 
-            try:
-                out = self.handle(op, payload)
-                self.send({"type": "result", "id": msg_id, "ok": True, "payload": out})
-            except Exception as e:
-                self.send({"type": "result", "id": msg_id, "ok": False, "error": str(e)})
\ No newline at end of file
+            if pool is not None:
+                pool.submit(self._handle_msg, msg_id, op, payload, send)
+            else:
+                self._handle_msg(msg_id, op, payload, send)
+
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,95 @@
+"""
+Долгоживущий сервер моделей.
+
+Держит состояние on_start() воркера (загруженные YOLO / EasyOCR) в памяти
+и обслуживает клиентов по Unix-сокету тем же JSONL-протоколом, что и subprocess-воркер.
+core.py подключается к сокету вместо запуска нового процесса, если задан WORKER_DAEMON_DIR.
+
+Из директории src:
+    python worker_daemon.py whiteboard_worker.py
+    python worker_daemon.py class_cutter_worker.py
+    python worker_daemon.py baseOCR2_worker.py --threads 4
+
+Настройки моделей берутся из окружения сервера (CONSPECT_BACKEND, CONSPECT_MODEL_PRECISION,
+CONSPECT_HOST_MODELS, ...), потоки на клиента - из --threads;
+при расхождении с core.py оркестратор не подключается и запускает свой воркер.
+"""
+import argparse
+import importlib
+import inspect
+import os
+import signal
+import socket
+import sys
+import threading
+from pathlib import Path
+
+from worker_base import BaseWorker
+
+
+DEFAULT_SOCKET_DIR = '/tmp/conspect'
+
+
+def socket_path(worker_script, socket_dir=DEFAULT_SOCKET_DIR):
+    return Path(socket_dir) / f"{Path(worker_script).stem}.sock"
+
+
+def load_worker(worker_script):
+    module = importlib.import_module(Path(worker_script).stem)
+    for obj in vars(module).values():
+        if inspect.isclass(obj) and issubclass(obj, BaseWorker) and obj.__module__ == module.__name__:
+            return obj()
+    raise RuntimeError(f"no BaseWorker subclass in {worker_script}")
+
+
+def serve_client(worker, conn, started, threads):
+    try:
+        with conn, conn.makefile("r", encoding="utf-8") as rfile, conn.makefile("w", encoding="utf-8") as wfile:
+            worker.serve(rfile, wfile, started, threads=threads, shutdown=False)
+    except (OSError, ValueError) as e:
+        print(f"[warn] client disconnected: {e}", file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("worker_script")
+    ap.add_argument("--socket-dir", default=DEFAULT_SOCKET_DIR)
+    ap.add_argument("--threads", type=int, default=1,
+                    help="потоков обработки на клиента; >1 только для потокобезопасных моделей")
+    args = ap.parse_args()
+
+    # потоки на клиента - тоже настройка, которую оркестратор сверяет (env_settings)
+    os.environ["CONSPECT_WORKER_THREADS"] = str(args.threads)
+    worker = load_worker(args.worker_script)
+    if args.threads <= 1:
+        # клиенты (в т.ч. несколько воркеров пула) обслуживаются по очереди
+        worker._handle_lock = threading.Lock()
+
+    started = {**worker.startup(), "daemon": True}
+
+    path = socket_path(args.worker_script, args.socket_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(str(path))
+    srv.listen()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"[ok] {args.worker_script} listening on {path}", file=sys.stderr)
+
+    try:
+        while True:
+            conn, _ = srv.accept()
+            threading.Thread(
+                target=serve_client, args=(worker, conn, started, args.threads), daemon=True
+            ).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.close()
+        path.unlink(missing_ok=True)
+        worker.on_shutdown()
+
+
+if __name__ == "__main__":
+    main()
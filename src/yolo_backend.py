@@ -0,0 +1,449 @@
+"""
+Бэкенды инференса YOLO для whiteboard_worker.py и class_cutter_worker.py.
+
+torch - ultralytics, как раньше, на CUDA или CPU;
+onnx  - best.pt один раз экспортируется в best.onnx рядом с весами,
+        инференс через onnxruntime с заданным числом потоков.
+
+torch возвращает ultralytics Results, onnx - лёгкий YoloResult с теми же полями boxes
+(xyxy, xywh, conf, cls) и masks.data на numpy (NMS и маски - numpy и cv2, без torch и
+ultralytics в процессе), поэтому код воркеров (_select_detection_index, _quad_for_index,
+_process_image) не меняется.
+
+Точность моделей: fp32; fp16 (torch - half на CUDA, onnx - веса во float16);
+int8 (только onnx: best.int8.onnx со статической калибровкой QDQ, собранный
+bench/quantization.py --calib-images; без калибровки - предупреждение и fp32:
+динамическая квантизация свёрток даёт ConvInteger, на CPU обычно медленнее fp32).
+
+Настройки приходят из окружения (выставляет core.py):
+    CONSPECT_BACKEND            auto | torch | onnx  (auto - torch на CUDA, если она есть, иначе onnx на CPU)
+    CONSPECT_MODEL_PRECISION    точность по моделям, например "whiteboard=int8,class_cutter=fp32"
+    CONSPECT_ORT_INTRA_THREADS  потоков внутри оператора, 0 - по умолчанию onnxruntime
+    CONSPECT_ORT_INTER_THREADS  потоков между операторами, 0 - по умолчанию onnxruntime
+"""
+import ast
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from worker_base import timed_import
+
+
+def cuda_available():
+    try:
+        with timed_import():
+            import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+def resolve_backend(backend=None):
+    backend = backend or os.environ.get("CONSPECT_BACKEND", "auto")
+    if backend == "auto":
+        return "torch" if cuda_available() else "onnx"
+    if backend not in ("torch", "onnx"):
+        raise ValueError(f"unknown inference backend: {backend}")
+    return backend
+
+
+PRECISIONS = ("fp32", "fp16", "int8")
+
+
+def model_precision(model_name):
+    """Точность модели (имя - директория весов: whiteboard, class_cutter) из CONSPECT_MODEL_PRECISION."""
+    for part in os.environ.get("CONSPECT_MODEL_PRECISION", "").split(","):
+        key, _, value = part.partition("=")
+        if key.strip() == model_name and value.strip():
+            return value.strip()
+    return "fp32"
+
+
+def load_yolo(weights, backend=None, precision=None):
+    weights = Path(weights)
+    if not weights.exists():
+        raise FileNotFoundError(f"Weights not found: {weights}")
+
+    precision = precision or model_precision(weights.parent.name)
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown model precision: {precision}")
+
+    if resolve_backend(backend) == "torch":
+        if precision == "int8":
+            raise ValueError("int8 models require the onnx backend")
+        return TorchYOLO(weights, half=precision == "fp16")
+    onnx_path = export_onnx(weights, precision=precision)
+    if onnx_path == variant_path(weights, "fp32"):
+        # int8 без статической калибровки
+        precision = "fp32"
+    return OnnxYOLO(
+        onnx_path,
+        intra_op=int(os.environ.get("CONSPECT_ORT_INTRA_THREADS", "0")),
+        inter_op=int(os.environ.get("CONSPECT_ORT_INTER_THREADS", "0")),
+        precision=precision,
+    )
+
+
+def _fresh(path, source):
+    return path.exists() and path.stat().st_mtime >= source.stat().st_mtime
+
+
+@contextmanager
+def _export_lock(weights):
+    # воркеры пула стартуют одновременно - экспортирует только один
+    with open(weights.with_suffix(".onnx.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def variant_path(weights, precision):
+    weights = Path(weights)
+    if precision == "fp32":
+        return weights.with_suffix(".onnx")
+    return weights.with_name(f"{weights.stem}.{precision}.onnx")
+
+
+def export_onnx(weights, imgsz=640, precision="fp32"):
+    """
+    best.pt -> best.onnx (и best.fp16.onnx / best.int8.onnx) рядом с весами;
+    повторно - только если источник новее. Для int8 без статической калибровки - best.onnx.
+    """
+    weights = Path(weights)
+    onnx_path = variant_path(weights, "fp32")
+
+    with _export_lock(weights):
+        if not _fresh(onnx_path, weights):
+            from ultralytics import YOLO
+            out = YOLO(str(weights)).export(format="onnx", imgsz=imgsz, dynamic=True, verbose=False)
+            if Path(out).resolve() != onnx_path.resolve():
+                os.replace(out, onnx_path)
+
+        if precision == "fp32":
+            return onnx_path
+
+        out_path = variant_path(weights, precision)
+        if precision == "int8" and not calibration_info_path(out_path).is_file():
+            print(f"[warn] {out_path}: no static calibration (bench/quantization.py --calib-images), using fp32 - "
+                  f"dynamic int8 quantization of conv layers is usually slower than fp32 on CPU")
+            return onnx_path
+        if not _fresh(out_path, onnx_path):
+            tmp = out_path.with_name(out_path.name + ".tmp")
+            if precision == "fp16":
+                convert_fp16(onnx_path, tmp)
+            else:
+                calibration = _recalibration(out_path)
+                if calibration is None:
+                    return onnx_path
+                quantize_int8(onnx_path, tmp, calibration=calibration)
+            os.replace(tmp, out_path)
+    return out_path
+
+
+IMG_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+def calibration_info_path(int8_path):
+    return Path(int8_path).with_name(Path(int8_path).name + ".calib.json")
+
+
+def save_calibration_info(int8_path, images_dir, count):
+    """Откуда взяты кадры статической калибровки: при переэкспорте best.onnx int8 калибруется заново на них же."""
+    info = {"images": str(Path(images_dir).resolve()), "count": count}
+    calibration_info_path(int8_path).write_text(json.dumps(info), encoding="utf-8")
+
+
+def calibration_images(images_dir, count=None):
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMG_EXTS)
+    imgs = [cv2.imread(str(p), cv2.IMREAD_COLOR) for p in paths[:count]]
+    return [img for img in imgs if img is not None]
+
+
+def _recalibration(int8_path):
+    """Кадры для повторной статической калибровки устаревшего int8; None - кадров нет, остаётся fp32."""
+    info_path = calibration_info_path(int8_path)
+    if not info_path.is_file():
+        return None
+    info = json.loads(info_path.read_text(encoding="utf-8"))
+    images_dir = Path(info["images"])
+    imgs = calibration_images(images_dir, info.get("count")) if images_dir.is_dir() else []
+    if imgs:
+        print(f"[info] {int8_path}: re-calibrating static int8 on {len(imgs)} images from {images_dir}")
+        return imgs
+    # калиброванную модель для старых весов оставлять нельзя, а динамическая на CPU обычно медленнее fp32
+    print(f"[warn] {int8_path}: calibration images {images_dir} are not available, using fp32; "
+          f"re-run bench/quantization.py --calib-images to rebuild the static int8 model")
+    info_path.unlink()
+    return None
+
+
+def convert_fp16(src, dst):
+    import onnx
+    from onnxconverter_common import float16
+
+    model = float16.convert_float_to_float16(onnx.load(str(src)), keep_io_types=True)
+    onnx.save(model, str(dst))
+
+
+def quantize_int8(src, dst, calibration=None):
+    """
+    calibration - список кадров BGR: статическая квантизация (QDQ, веса и активации int8).
+    Динамическая не поддерживается: свёртки YOLO становятся ConvInteger, на CPU обычно медленнее fp32.
+    """
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    if not calibration:
+        raise ValueError("int8 quantization needs calibration images (static QDQ)")
+    quantize_static(
+        str(src), str(dst), _CalibrationReader(src, calibration),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+    )
+
+
+class _CalibrationReader:
+    """CalibrationDataReader для quantize_static: кадры с той же предобработкой, что и в OnnxYOLO."""
+
+    def __init__(self, onnx_path, imgs):
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+        self.input_name = session.get_inputs()[0].name
+        imgsz = _meta_imgsz(session.get_modelmeta().custom_metadata_map)
+        self._batches = iter([to_blob([letterbox(img, imgsz)[0]]) for img in imgs])
+
+    def get_next(self):
+        batch = next(self._batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+
+def _meta_imgsz(meta):
+    imgsz = ast.literal_eval(meta.get("imgsz", "[640, 640]"))
+    return (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+
+
+def letterbox(img, imgsz):
+    """Как LetterBox ultralytics (по центру, поля 114); возвращает кадр и (top, left, h, w) содержимого."""
+    h, w = img.shape[:2]
+    new_h, new_w = imgsz
+    r = min(new_h / h, new_w / w)
+    unpad_w, unpad_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (new_w - unpad_w) / 2, (new_h - unpad_h) / 2
+
+    if (w, h) != (unpad_w, unpad_h):
+        img = cv2.resize(img, (unpad_w, unpad_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return img, (top, left, unpad_h, unpad_w)
+
+
+def to_blob(imgs):
+    # BGR HWC uint8 -> RGB NCHW float32 0..1
+    batch = np.stack(imgs)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+class TorchYOLO:
+    def __init__(self, weights, half=False):
+        with timed_import():
+            from ultralytics import YOLO
+        self.model = YOLO(str(weights))
+        self.device = "cuda" if cuda_available() else "cpu"
+        # half на CPU ultralytics не поддерживает
+        self.half = half and self.device == "cuda"
+        self.name = f"torch:{self.device}:{'fp16' if self.half else 'fp32'}"
+
+    def predict(self, imgs, conf, iou):
+        return self.model.predict(
+            source=imgs,
+            conf=conf,
+            iou=iou,
+            device=self.device,
+            half=self.half,
+            save=False,
+            verbose=False
+        )
+
+
+class OnnxYOLO:
+    """
+    Экспортированная модель ultralytics в onnxruntime.
+    Предобработка (letterbox) и постобработка (NMS, маски из прототипов) - как в
+    ultralytics; маски сегментации обрезаются по letterbox-полям (остаются в пропорциях кадра).
+    """
+
+    def __init__(self, onnx_path, intra_op=0, inter_op=0, precision="fp32"):
+        with timed_import():
+            import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        if intra_op > 0:
+            opts.intra_op_num_threads = intra_op
+        if inter_op > 0:
+            opts.inter_op_num_threads = inter_op
+            opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        providers = ["CPUExecutionProvider"]
+        if "CUDAExecutionProvider" in ort.get_available_providers() and cuda_available():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = ort.InferenceSession(str(onnx_path), sess_options=opts, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta["names"])
+        self.imgsz = _meta_imgsz(meta)
+        self.segment = meta.get("task") == "segment"
+        self.name = f"onnx:{self.session.get_providers()[0]}:{precision}"
+
+    def predict(self, imgs, conf, iou):
+        boxed = [letterbox(img, self.imgsz) for img in imgs]
+        batch = to_blob([b[0] for b in boxed])
+        shape = batch.shape[2:]
+
+        outputs = self.session.run(None, {self.input_name: batch})
+        results = []
+        for i, img in enumerate(imgs):
+            det = non_max_suppression(outputs[0][i], conf, iou, nc=len(self.names))
+            top, left, unpad_h, unpad_w = boxed[i][1]
+            masks = None
+            if self.segment:
+                masks = process_masks(outputs[1][i], det[:, 6:], det[:, :4], shape)
+                masks = masks[:, top:top + unpad_h, left:left + unpad_w]
+            gain = min(shape[0] / img.shape[0], shape[1] / img.shape[1])
+            det[:, :4] = scale_boxes(det[:, :4], (top, left), gain, img.shape)
+            results.append(YoloResult(det[:, :6], masks, self.names, img.shape[:2]))
+        return results
+
+
+MAX_WH = 7680    # сдвиг рамок по классу: NMS по каждому классу отдельно одним вызовом, как в ultralytics
+MAX_DET = 300
+MAX_NMS = 30000
+
+
+def non_max_suppression(pred, conf, iou, nc):
+    """
+    Один кадр выхода YOLO (4 + nc + nm, N) -> (n, 6 + nm): x1, y1, x2, y2, conf, cls, коэффициенты масок;
+    как ultralytics.utils.ops.non_max_suppression (один класс на рамку, NMS по классам).
+    """
+    pred = pred.T
+    scores = pred[:, 4:4 + nc]
+    cls = scores.argmax(1)
+    best = scores[np.arange(len(cls)), cls]
+    keep = best > conf
+    pred, cls, best = pred[keep], cls[keep], best[keep]
+    if len(pred) > MAX_NMS:
+        top = np.argsort(-best)[:MAX_NMS]
+        pred, cls, best = pred[top], cls[top], best[top]
+
+    xy, wh = pred[:, :2], pred[:, 2:4]
+    xyxy = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+    det = np.concatenate([xyxy, best[:, None], cls[:, None].astype(np.float32), pred[:, 4 + nc:]], axis=1)
+    if not len(det):
+        return det.astype(np.float32)
+
+    # cv2.dnn.NMSBoxes - рамки (x, y, w, h)
+    shifted = np.concatenate([xyxy[:, :2] + cls[:, None] * MAX_WH, wh], axis=1)
+    idx = cv2.dnn.NMSBoxes(shifted.tolist(), best.tolist(), conf, iou)
+    idx = np.asarray(idx, dtype=int).reshape(-1)[:MAX_DET]
+    return det[idx].astype(np.float32)
+
+
+def process_masks(proto, coefs, boxes, shape):
+    """
+    Маски по прототипам: coefs @ proto, обрезка по рамке, билинейное увеличение до shape (вход модели)
+    и порог - как ultralytics.utils.ops.process_mask(upsample=True). Возвращает (n, h, w) float32 0/1.
+    """
+    nm, mh, mw = proto.shape
+    h, w = shape
+    if not len(coefs):
+        return np.zeros((0, h, w), dtype=np.float32)
+    logits = (coefs @ proto.reshape(nm, -1)).reshape(-1, mh, mw)
+
+    # рамки в разрешении прототипов, вне рамки - ниже порога
+    b = boxes * np.array([mw / w, mh / h, mw / w, mh / h], dtype=np.float32)
+    cols, rows = np.arange(mw, dtype=np.float32), np.arange(mh, dtype=np.float32)
+    inside = ((cols[None, None, :] >= b[:, 0, None, None]) & (cols[None, None, :] < b[:, 2, None, None])
+              & (rows[None, :, None] >= b[:, 1, None, None]) & (rows[None, :, None] < b[:, 3, None, None]))
+    logits = np.where(inside, logits, 0.0).astype(np.float32)
+
+    # половинные центры пикселей, как у interpolate(align_corners=False);  порог сразу - без стопки float-масок
+    up = np.stack([cv2.resize(m, (w, h), interpolation=cv2.INTER_LINEAR) > 0.0 for m in logits])
+    return up.astype(np.float32)
+
+
+def scale_boxes(xyxy, pad, gain, shape):
+    """Рамки из letterbox-входа в координаты кадра shape (h, w), как ultralytics.utils.ops.scale_boxes."""
+    top, left = pad
+    out = (xyxy - np.array([left, top, left, top], dtype=np.float32)) / gain
+    out[:, [0, 2]] = out[:, [0, 2]].clip(0, shape[1])
+    out[:, [1, 3]] = out[:, [1, 3]].clip(0, shape[0])
+    return out
+
+
+class _Array(np.ndarray):
+    """numpy с .cpu() / .detach() / .numpy(), как у тензоров torch в Results."""
+
+    def cpu(self):
+        return self
+
+    def detach(self):
+        return self
+
+    def numpy(self):
+        return self.view(np.ndarray)
+
+
+def _array(a):
+    return np.ascontiguousarray(a, dtype=np.float32).view(_Array)
+
+
+class Boxes:
+    def __init__(self, data):
+        self.data = _array(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def xywh(self):
+        xyxy = self.data[:, :4].numpy()
+        return _array(np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], axis=1))
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5]
+
+
+class Masks:
+    def __init__(self, data):
+        self.data = _array(data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class YoloResult:
+    """Поля ultralytics Results, которые читают воркеры: boxes, masks (None - модель без сегментации), names."""
+
+    def __init__(self, boxes, masks, names, orig_shape):
+        self.boxes = Boxes(boxes)
+        self.masks = Masks(masks) if masks is not None else None
+        self.names = names
+        self.orig_shape = orig_shape
+
+    def __len__(self):
+        return len(self.boxes)